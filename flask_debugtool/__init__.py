@@ -1,13 +1,33 @@
+import functools
+import logging
 import os
+import threading
+import weakref
 
-from flask import Blueprint, current_app, request, g, send_from_directory, jsonify
+# First, so that the imports of the toolbar's own dependencies are recorded
+from . import importtime
+if os.environ.get(importtime.ENV_VAR):
+    importtime.install()
+
+from flask import Blueprint, current_app, request, g, jsonify, abort, \
+    Response, template_rendered
 from flask.globals import _request_ctx_stack
-from jinja2 import Environment, PackageLoader
+from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache
 from werkzeug.urls import url_quote_plus
 
-from .compat import iteritems
-from .toolbar import DebugToolbar
-from .utils import decode_text
+from .assets import StaticAssets
+from .compat import iteritems, perf_counter
+from .finalizer import Finalizer
+from .metrics import CONTENT_TYPE, LogCounter, MetricsRegistry, cpu_time
+from .middleware import ENDPOINT_KEY, WSGI_NAME, WSGITimingMiddleware
+from .replay import REPLAY_KEY
+from .spans import span
+from .stats import RequestStats
+from .toolbar import DebugToolbar, current_toolbar
+from .traces import TraceWriter
+from .utils import REQUEST_ID_HEADER, cache_key, decode_text, \
+    get_debug_queries
+from .watchdog import Watch, get_watchdog
 
 
 module = Blueprint('debugtoolbar', __name__)
@@ -26,6 +46,12 @@ def replace_insensitive(string, target, replacement):
         return string
 
 
+def _count_template(sender, **extra):
+    ctx = _request_ctx_stack.top
+    if ctx is not None and getattr(ctx, 'debug_toolbar_templates', None) is not None:
+        ctx.debug_toolbar_templates += 1
+
+
 def _printable(value):
     try:
         return decode_text(repr(value))
@@ -37,19 +63,31 @@ def _printable(value):
 class DebugToolbarExtension(object):
     _static_dir = os.path.realpath(
         os.path.join(os.path.dirname(__file__), 'static'))
+    _templates_dir = os.path.realpath(
+        os.path.join(os.path.dirname(__file__), 'templates'))
 
     _redirect_codes = [301, 302, 303, 304]
 
+    _request_id_header = REQUEST_ID_HEADER
+
     def __init__(self, app=None, cache=None):
         self.app = app
-        self.debug_toolbars = {}
         self.cache = cache
+        self.assets = None
+        self.stats = RequestStats()
+        self.metrics = None
+        self.trace_writer = None
+        self.finalizer = None
+        # Toolbars of the requests being handled, by request id
+        self.in_flight = weakref.WeakValueDictionary()
+        self.in_flight_lock = threading.Lock()
         # Configure jinja for the internal templates and add url rules
         # for static data
         self.jinja_env = Environment(
             autoescape=True,
             extensions=['jinja2.ext.i18n', 'jinja2.ext.with_'],
-            loader=PackageLoader(__name__, 'templates'))
+            # rather than a PackageLoader, which imports pkg_resources
+            loader=FileSystemLoader(self._templates_dir))
         self.jinja_env.filters['urlencode'] = url_quote_plus
         self.jinja_env.filters['printable'] = _printable
 
@@ -65,15 +103,40 @@ class DebugToolbarExtension(object):
         for k, v in iteritems(self._default_config(app)):
             app.config.setdefault(k, v)
 
+        # The commands are there even with the toolbar disabled, to say so
+        if hasattr(app, 'cli'):
+            from .cli import debugtool
+            app.cli.add_command(debugtool)
+
         if not app.config['DEBUG_TB_ENABLED']:
             return
+        app.extensions['debugtoolbar'] = self
 
         if not app.config.get('SECRET_KEY'):
             raise RuntimeError(
                 "The Flask-DebugToolbar requires the 'SECRET_KEY' config "
                 "var to be set")
 
-        DebugToolbar.load_panels(app)
+        if app.config['DEBUG_TB_TEMPLATE_CACHE_DIR']:
+            self.jinja_env.bytecode_cache = FileSystemBytecodeCache(
+                app.config['DEBUG_TB_TEMPLATE_CACHE_DIR'])
+
+        DebugToolbar.load_panels(app, self.jinja_env, self.cache)
+
+        if self.finalizer is None:
+            self.finalizer = Finalizer(app.config['DEBUG_TB_FINALIZE_WORKERS'])
+
+        if app.config['DEBUG_TB_METRICS_ENABLED'] and self.metrics is None:
+            self.metrics = MetricsRegistry(app.config['DEBUG_TB_METRICS_DIR'])
+            logging.getLogger().addHandler(LogCounter(self.metrics))
+            template_rendered.connect(_count_template)
+
+        # Compile the toolbar templates now rather than on the first request
+        # showing the toolbar, the bytecode cache makes it cheap for the
+        # following workers
+        if app.config['DEBUG_TB_PRECOMPILE_TEMPLATES']:
+            for template_name in self.jinja_env.list_templates():
+                self.jinja_env.get_template(template_name)
 
         app.before_request(self.process_request)
         app.after_request(self.process_response)
@@ -82,10 +145,33 @@ class DebugToolbarExtension(object):
         # Monkey-patch the Flask.dispatch_request method
         app.dispatch_request = self.dispatch_request
 
-        app.add_url_rule('/_debug_toolbar/static/<path:filename>',
-                         '_debug_toolbar.static', self.send_static_file)
-        app.add_url_rule('/_debug_toolbar/info/<path:name>',
+        if app.config['DEBUG_TB_WSGI_TIMING']:
+            app.wsgi_app = WSGITimingMiddleware(
+                app.wsgi_app, self._request_id_header,
+                functools.partial(self.record_wsgi_timings, app))
+
+        # The static files are served below a digest of their contents, so
+        # they can be cached by the browser for good
+        if self.assets is None:
+            self.assets = StaticAssets(self._static_dir)
+        app.add_url_rule(
+            '/_debug_toolbar/static/%s/<path:filename>' % self.assets.version,
+            '_debug_toolbar.static', self.send_static_file)
+        app.add_url_rule('/_debug_toolbar/toolbar/<request_id>',
+                         '_debug_toolbar.toolbar', self.send_toolbar)
+        app.add_url_rule('/_debug_toolbar/info/<request_id>',
                          '_debug_toolbar.info', self.send_info)
+        app.add_url_rule('/_debug_toolbar/info/<request_id>/<path:name>',
+                         '_debug_toolbar.info', self.send_info)
+        if app.config['DEBUG_TB_TRACE_DIR'] and self.trace_writer is None:
+            self.trace_writer = TraceWriter(
+                app.config['DEBUG_TB_TRACE_DIR'],
+                app.config['DEBUG_TB_TRACE_FORMATS'],
+                app.config['DEBUG_TB_TRACE_MAX_FILES'])
+
+        if self.metrics is not None:
+            app.add_url_rule('/_debug_toolbar/metrics',
+                             '_debug_toolbar.metrics', self.send_metrics)
         app.register_blueprint(module, url_prefix='/_debug_toolbar/views')
 
     def _default_config(self, app):
@@ -93,6 +179,21 @@ class DebugToolbarExtension(object):
             'DEBUG_TB_ENABLED': app.debug,
             'DEBUG_TB_HOSTS': (),
             'DEBUG_TB_INTERCEPT_REDIRECTS': True,
+            'DEBUG_TB_DEFERRED': False,
+            'DEBUG_TB_PRECOMPILE_TEMPLATES': True,
+            'DEBUG_TB_TEMPLATE_CACHE_DIR': None,
+            'DEBUG_TB_STATS_ENABLED': True,
+            'DEBUG_TB_METRICS_ENABLED': False,
+            'DEBUG_TB_METRICS_DIR': None,
+            'DEBUG_TB_HUNG_THRESHOLD': None,
+            'DEBUG_TB_HUNG_DUMP_INTERVAL': 5,
+            'DEBUG_TB_WSGI_TIMING': False,
+            'DEBUG_TB_TIMED_FUNCTIONS': (),
+            'DEBUG_TB_TRACE_DIR': None,
+            'DEBUG_TB_TRACE_FORMATS': ('chrome', 'otlp'),
+            'DEBUG_TB_TRACE_MAX_FILES': 100,
+            'DEBUG_TB_FINALIZE_WORKERS': 2,
+            'DEBUG_TB_FINALIZE_TIMEOUT': 10,
             'DEBUG_TB_PANELS': (
                 'flask_debugtool.panels.versions.VersionDebugPanel',
                 'flask_debugtool.panels.timer.TimerDebugPanel',
@@ -101,9 +202,14 @@ class DebugToolbarExtension(object):
                 'flask_debugtool.panels.config_vars.ConfigVarsDebugPanel',
                 'flask_debugtool.panels.template.TemplateDebugPanel',
                 'flask_debugtool.panels.sqlalchemy.SQLAlchemyDebugPanel',
+                'flask_debugtool.panels.cache.CacheDebugPanel',
+                'flask_debugtool.panels.redis.RedisDebugPanel',
                 'flask_debugtool.panels.logger.LoggingPanel',
                 'flask_debugtool.panels.profiler.ProfilerDebugPanel',
                 'flask_debugtool.panels.lineprofiler.LineProfilerPanel',
+                'flask_debugtool.panels.timed_functions.TimedFunctionsDebugPanel',
+                # shows the spans recorded by the panels above
+                'flask_debugtool.panels.timeline.TimelineDebugPanel',
             ),
         }
 
@@ -125,13 +231,33 @@ class DebugToolbarExtension(object):
 
         # otherwise dispatch to the handler for that endpoint
         view_func = app.view_functions[rule.endpoint]
+        process_view_start = perf_counter()
         view_func = self.process_view(app, view_func, req.view_args)
 
-        return view_func(**req.view_args)
+        toolbar = current_toolbar()
+        if toolbar is None:
+            return view_func(**req.view_args)
+
+        start = perf_counter()
+        toolbar.spans.add('flask', 'before_request', toolbar.start,
+                          process_view_start)
+        toolbar.spans.add('toolbar', 'process_view', process_view_start, start)
+        try:
+            return view_func(**req.view_args)
+        finally:
+            toolbar.view_end = end = perf_counter()
+            toolbar.spans.add('flask', 'view', start, end)
+
+    def _is_toolbar_request(self):
+        """Return a boolean to indicate if the request is for the toolbar's
+        own views, static files or info, or is replayed by it."""
+        return (request.blueprint == 'debugtoolbar' or
+                (request.endpoint or '').startswith('_debug_toolbar.') or
+                REPLAY_KEY in request.environ)
 
     def _show_toolbar(self):
         """Return a boolean to indicate if we need to show the toolbar."""
-        if request.blueprint == 'debugtoolbar':
+        if self._is_toolbar_request():
             return False
 
         hosts = current_app.config['DEBUG_TB_HOSTS']
@@ -142,23 +268,140 @@ class DebugToolbarExtension(object):
 
     def send_static_file(self, filename):
         """Send a static file from the flask-debugtoolbar static directory."""
-        return send_from_directory(self._static_dir, filename)
+        return self.assets.send(filename)
+
+    def send_toolbar(self, request_id):
+        """Send the toolbar markup of a request, for the deferred loader"""
+        self._wait_finalized(request_id)
+        toolbar_html = DebugToolbar.render_stored(
+            self.jinja_env, self.cache, request_id)
+        if toolbar_html is None:
+            abort(404)
+        return toolbar_html
+
+    def send_info(self, request_id, name=None):
+        """Send the data stored for a request, either of a single panel or,
+        without a panel name, of all its panels."""
+        self._wait_finalized(request_id)
+        if name is not None:
+            summary, info, wsgi = self.cache.get_many(
+                cache_key(request_id), cache_key(request_id, name),
+                cache_key(request_id, WSGI_NAME))
+            if summary is not None and info is not None:
+                summary['wsgi'] = wsgi
+                info = dict(info, content=DebugToolbar.stored_content(
+                    self.jinja_env, name, info, summary))
+            return jsonify(info=info)
+
+        summary = self.cache.get(cache_key(request_id))
+        if summary is None:
+            return jsonify(request=None, panels={})
+        names = summary['panels']
+        values = self.cache.get_many(*[cache_key(request_id, n)
+                                       for n in names + [WSGI_NAME]])
+        summary['wsgi'] = values.pop()
+        return jsonify(request=summary, panels=dict(zip(names, values)))
+
+    def _wait_finalized(self, request_id):
+        self.finalizer.wait(request_id,
+                            current_app.config['DEBUG_TB_FINALIZE_TIMEOUT'])
+
+    def send_metrics(self):
+        """Send the metrics of all the requests, in the OpenMetrics text
+        format"""
+        return Response(self.metrics.render(), content_type=CONTENT_TYPE)
+
+    def _record_stats(self, status_code):
+        """Add the current request to the stats and metrics"""
+        ctx = _request_ctx_stack.top
+        start = getattr(ctx, 'debug_toolbar_start', None)
+        if start is None:
+            return
+        ctx.debug_toolbar_start = None
+        duration = perf_counter() - start
+        rule = ctx.request.url_rule
+        endpoint = rule.endpoint if rule is not None else '<unmatched>'
+        if current_app.config['DEBUG_TB_STATS_ENABLED']:
+            self.stats.add(endpoint, status_code, duration)
+        if self.metrics is not None:
+            self._record_metrics(ctx, endpoint, status_code, duration)
+
+    def _record_metrics(self, ctx, endpoint, status_code, duration):
+        labels = (('endpoint', endpoint),)
+        metrics = self.metrics
+        metrics.observe('flask_debugtool_request_duration_seconds',
+                        labels + (('status', '%dxx' % (status_code // 100)),),
+                        duration)
+        metrics.observe('flask_debugtool_request_cpu_seconds', labels,
+                        cpu_time() - ctx.debug_toolbar_cpu_start)
+        metrics.observe('flask_debugtool_request_templates', labels,
+                        ctx.debug_toolbar_templates)
+        ctx.debug_toolbar_templates = None
+        queries = get_debug_queries()
+        if queries is not None:
+            metrics.observe('flask_debugtool_request_queries', labels,
+                            len(queries))
+            metrics.observe('flask_debugtool_request_query_duration_seconds',
+                            labels, sum(q.duration for q in queries))
+        metrics.maybe_flush()
+
+    def record_wsgi_timings(self, app, environ, request_id, status_code,
+                            timings):
+        """Add the timings measured by the WSGI middleware, once the server
+        closed the response (outside of any context), to the stats and the
+        data of the request, stored apart from its summary which the
+        finalizer may still be writing"""
+        endpoint = environ.get(ENDPOINT_KEY)
+        if endpoint is None:
+            # the toolbar's own requests
+            return
+        if status_code is not None and app.config['DEBUG_TB_STATS_ENABLED']:
+            self.stats.add(endpoint, status_code, timings['total'], timing='wsgi')
+            self.stats.add(endpoint, status_code, timings['ttfb'], timing='ttfb')
 
-    def send_info(self, name):
-        """Send info """
-        info = self.cache.get("DEBUGTOOLBAR:%s" % name)
-        return jsonify(info=info)
+        if request_id is not None and self.cache:
+            self.cache.set(cache_key(request_id, WSGI_NAME), timings)
 
     def process_request(self):
         g.debug_toolbar = self
 
+        if not self._is_toolbar_request():
+            rule = request.url_rule
+            request.environ[ENDPOINT_KEY] = \
+                rule.endpoint if rule is not None else '<unmatched>'
+
+        # All requests are timed for the stats and metrics, not only the
+        # ones showing the toolbar
+        if ((current_app.config['DEBUG_TB_STATS_ENABLED'] or
+                self.metrics is not None) and not self._is_toolbar_request()):
+            ctx = _request_ctx_stack.top
+            ctx.debug_toolbar_start = perf_counter()
+            if self.metrics is not None:
+                ctx.debug_toolbar_cpu_start = cpu_time()
+                ctx.debug_toolbar_templates = 0
+
         if not self._show_toolbar():
             return
 
         real_request = request._get_current_object()
 
-        self.debug_toolbars[real_request] = DebugToolbar(real_request, self.jinja_env, self.cache)
-        for panel in self.debug_toolbars[real_request].panels:
+        # The toolbar lives in the request context rather than in a dict
+        # shared by all requests: it is only seen by its own request (thread
+        # or greenlet) and goes away with the context even if the teardown
+        # never runs
+        toolbar = DebugToolbar(real_request, self.jinja_env, self.cache)
+        _request_ctx_stack.top.debug_toolbar = toolbar
+
+        # Dump the stack of requests running for too long, while they run
+        threshold = current_app.config['DEBUG_TB_HUNG_THRESHOLD']
+        if threshold is not None:
+            toolbar.watch = Watch(toolbar.dump_stack, threshold,
+                                  current_app.config['DEBUG_TB_HUNG_DUMP_INTERVAL'])
+            get_watchdog().watch(toolbar.watch)
+            with self.in_flight_lock:
+                self.in_flight[toolbar.request_id] = toolbar
+
+        for panel in toolbar.panels:
             panel.process_request(real_request)
 
     def process_view(self, app, view_func, view_kwargs):
@@ -166,18 +409,29 @@ class DebugToolbarExtension(object):
         This is done by the dispatch_request method.
         """
         real_request = request._get_current_object()
-        if real_request in self.debug_toolbars:
-            for panel in self.debug_toolbars[real_request].panels:
+        toolbar = current_toolbar()
+        if toolbar is not None:
+            for panel in toolbar.panels:
                 new_view = panel.process_view(real_request, view_func, view_kwargs)
                 if new_view:
                     view_func = new_view
         return view_func
 
     def process_response(self, response):
+        self._record_stats(response.status_code)
+
         real_request = request._get_current_object()
-        if real_request not in self.debug_toolbars:
+        toolbar = current_toolbar()
+        if toolbar is None:
             return response
 
+        response.headers[self._request_id_header] = toolbar.request_id
+
+        toolbar.response_start = perf_counter()
+        if toolbar.view_end is not None:
+            toolbar.spans.add('flask', 'after_request', toolbar.view_end,
+                              toolbar.response_start)
+
         # Intercept http redirect codes and display an html page with a
         # link to the target.
         if current_app.config['DEBUG_TB_INTERCEPT_REDIRECTS']:
@@ -198,12 +452,16 @@ class DebugToolbarExtension(object):
         # If the http response code is 200 then we process to add the
         # toolbar to the returned html response.
         if response.status_code == 200:
-            for panel in self.debug_toolbars[real_request].panels:
-                panel.process_response(real_request, response)
+            toolbar.process_response(response)
 
             if response.headers['content-type'].startswith('text/html') and response.is_sequence:
                 response_html = response.data.decode(response.charset)
-                toolbar_html = self.debug_toolbars[real_request].render_toolbar()
+                if current_app.config['DEBUG_TB_DEFERRED']:
+                    toolbar_html = toolbar.render_loader()
+                else:
+                    # the inline toolbar shows the content of the panels
+                    toolbar.finalize()
+                    toolbar_html = toolbar.render_toolbar()
 
                 content = replace_insensitive(
                     response_html, '</body>', toolbar_html + '</body>')
@@ -211,11 +469,72 @@ class DebugToolbarExtension(object):
                 response.response = [content]
                 response.content_length = len(content)
 
+        toolbar.store_summary(response)
+        # The rest is left to the pool, off the response's way
+        self.finalizer.submit(toolbar.request_id, functools.partial(
+            self.finalize, current_app._get_current_object(), toolbar,
+            response))
         return response
 
+    def finalize(self, app, toolbar, response):
+        """Finalize the panels of a request and write its trace, possibly
+        on a thread of the pool once the request is over"""
+        try:
+            with app.app_context():
+                toolbar.finalize()
+                if self.trace_writer is not None:
+                    self.trace_writer.write(toolbar, response, app.name)
+        except Exception:
+            app.logger.exception('Finalizing the toolbar of request %s failed',
+                                 toolbar.request_id)
+
     def teardown_request(self, exc):
-        self.debug_toolbars.pop(request._get_current_object(), None)
+        # No response was processed when the view raised an exception
+        self._record_stats(500)
+
+        toolbar = current_toolbar()
+        if toolbar is not None and toolbar.watch is not None:
+            get_watchdog().unwatch(toolbar.watch)
+            with self.in_flight_lock:
+                self.in_flight.pop(toolbar.request_id, None)
+
+        ctx = _request_ctx_stack.top
+        if ctx is not None:
+            ctx.debug_toolbar = None
 
     def render(self, template_name, context):
         template = self.jinja_env.get_template(template_name)
         return template.render(**context)
+
+
+@module.route('/hung')
+def hung():
+    extension = g.debug_toolbar
+    with extension.in_flight_lock:
+        toolbars = list(extension.in_flight.values())
+    now = perf_counter()
+    requests = [{
+        'id': toolbar.request_id,
+        'method': toolbar.request.method,
+        'url': toolbar.request.full_path.rstrip('?'),
+        'elapsed': now - toolbar.start,
+        'stack_dumps': list(toolbar.stack_dumps),
+    } for toolbar in toolbars if toolbar.stack_dumps]
+    requests.sort(key=lambda r: -r['elapsed'])
+    return extension.render('hung.html', {
+        'requests': requests,
+        'threshold': current_app.config['DEBUG_TB_HUNG_THRESHOLD'],
+    })
+
+
+@module.route('/stats')
+def stats():
+    windows = RequestStats.windows
+    window = request.args.get('window', windows[0], type=int)
+    if window not in windows:
+        window = windows[0]
+    return g.debug_toolbar.render('stats.html', {
+        'rows': g.debug_toolbar.stats.summary(window),
+        'window': window,
+        'windows': windows,
+    })
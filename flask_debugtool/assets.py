@@ -0,0 +1,103 @@
+import gzip
+import hashlib
+import io
+import mimetypes
+import os
+
+from flask import abort, current_app, request
+
+
+class StaticAssets(object):
+    """
+    The toolbar's static files, fingerprinted once so they can be served
+    with far-future cache headers.
+
+    All files are served below a path containing a digest of their
+    contents, so the URLs change whenever any of the files does.
+    """
+    # Far-future caching for the fingerprinted urls, a year as per RFC 2616
+    max_age = 365 * 24 * 60 * 60
+
+    # Files worth sending gzipped when the client accepts it
+    compressible_types = ('text/', 'application/javascript',
+                          'application/x-javascript')
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.etags = {}
+        self._data = {}
+        self._gzipped = {}
+
+        version = hashlib.md5()
+        for filename in self._iter_files():
+            with open(os.path.join(self.directory, filename), 'rb') as fp:
+                etag = hashlib.md5(fp.read()).hexdigest()
+            self.etags[filename] = etag
+            version.update(('%s:%s\n' % (filename, etag)).encode('utf-8'))
+        self.version = version.hexdigest()[:12]
+
+    def _iter_files(self):
+        for root, dirs, files in os.walk(self.directory):
+            dirs.sort()
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                relpath = os.path.relpath(path, self.directory)
+                yield relpath.replace(os.path.sep, '/')
+
+    def _read(self, filename):
+        try:
+            return self._data[filename]
+        except KeyError:
+            pass
+        with open(os.path.join(self.directory, filename), 'rb') as fp:
+            data = self._data[filename] = fp.read()
+        return data
+
+    def _read_gzipped(self, filename):
+        try:
+            return self._gzipped[filename]
+        except KeyError:
+            pass
+        # Prefer a variant compressed at build time when there is one
+        path = os.path.join(self.directory, filename + '.gz')
+        if os.path.exists(path):
+            with open(path, 'rb') as fp:
+                data = fp.read()
+        else:
+            buf = io.BytesIO()
+            with gzip.GzipFile(filename='', mode='wb', fileobj=buf,
+                               mtime=0) as fp:
+                fp.write(self._read(filename))
+            data = buf.getvalue()
+        self._gzipped[filename] = data
+        return data
+
+    def is_compressible(self, mimetype):
+        return mimetype.startswith(self.compressible_types)
+
+    def send(self, filename):
+        """Send a static file, gzipped when the client accepts it"""
+        if filename not in self.etags:
+            abort(404)
+
+        mimetype = (mimetypes.guess_type(filename)[0] or
+                    'application/octet-stream')
+        etag = self.etags[filename]
+
+        use_gzip = (self.is_compressible(mimetype) and
+                    request.accept_encodings['gzip'])
+        if use_gzip:
+            data = self._read_gzipped(filename)
+            etag += '-gzip'
+        else:
+            data = self._read(filename)
+
+        response = current_app.response_class(data, mimetype=mimetype)
+        if use_gzip:
+            response.content_encoding = 'gzip'
+        if self.is_compressible(mimetype):
+            response.vary.add('Accept-Encoding')
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = (
+            'public, max-age=%d, immutable' % self.max_age)
+        return response.make_conditional(request)
@@ -0,0 +1,292 @@
+"""
+Benchmark of the toolbar's overhead.
+
+Drives a small but representative application (templates, logging, cache
+calls, JSON, and SQL when Flask-SQLAlchemy is installed) through the test
+client with the toolbar disabled, with each of the default panels enabled
+alone, and with all of them enabled::
+
+    $ python -m flask_debugtool.benchmark --save baseline.json
+    $ python -m flask_debugtool.benchmark --baseline baseline.json
+
+and reports the latency percentiles, throughput and memory allocated per
+configuration. Against a baseline, configurations whose median or 90th
+percentile latency grew by more than the tolerance are reported as
+regressions and the exit status is 1.
+
+The panels are finalized on the request thread rather than on a pool, so
+that the latencies include all of their work. The panels the user
+activates are activated: the profiler through ``DEBUG_TB_PROFILER_ENABLED``,
+the line profiler by a function of the application registered with
+``line_profile``. Those which still aren't active, e.g. the line profiler
+without line_profiler installed, are marked as inactive in the report. The panels' hooks (e.g. on
+the cache) are installed once per process, so the configurations measured
+after the first one using them pay for the hooks' checks: the toolbar
+disabled, measured first, is unaffected.
+"""
+import argparse
+import gc
+import json
+import logging
+import sys
+
+from flask import Flask, jsonify, render_template_string
+from werkzeug.utils import import_string
+
+from . import DebugToolbarExtension
+from .compat import perf_counter
+from .panels.lineprofiler import line_profile
+from .stats import percentile
+from .toolbar import current_toolbar
+
+try:
+    from werkzeug.contrib.cache import SimpleCache
+except ImportError:
+    from cachelib import SimpleCache
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None  # Python 2
+
+try:
+    from flask_sqlalchemy import SQLAlchemy
+except ImportError:
+    SQLAlchemy = None
+
+PAGE = '''<html>
+<head><title>{{ title }}</title></head>
+<body>
+  <h1>{{ title }}</h1>
+  <ul>
+  {% for item in items %}
+    <li class="{{ loop.cycle('odd', 'even') }}">{{ item.name|e }}: {{ '%.2f'|format(item.price) }}</li>
+  {% endfor %}
+  </ul>
+</body>
+</html>'''
+
+logger = logging.getLogger('flask_debugtool.benchmark')
+
+
+@line_profile
+def total_price(items):
+    total = 0.0
+    for item in items:
+        total += item['price']
+    return total
+
+
+def create_app(config):
+    """The application benchmarked, with the toolbar configured by
+    ``config`` (on top of the defaults)"""
+    app = Flask(__name__)
+    app.debug = True
+    app.config['SECRET_KEY'] = 'benchmark'
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['SQLALCHEMY_RECORD_QUERIES'] = True
+    app.config.update(config)
+    cache = SimpleCache()
+
+    db = None
+    if SQLAlchemy is not None:
+        db = SQLAlchemy(app)
+
+        class Item(db.Model):
+            id = db.Column(db.Integer, primary_key=True)
+            name = db.Column(db.String(50))
+            price = db.Column(db.Float)
+
+        with app.app_context():
+            db.create_all()
+            db.session.add_all([Item(name='item %d' % i, price=i * 1.5)
+                                for i in range(50)])
+            db.session.commit()
+
+    def load_items():
+        if db is None:
+            return [{'name': 'item %d' % i, 'price': i * 1.5}
+                    for i in range(50)]
+        return [{'name': item.name, 'price': item.price}
+                for item in Item.query.limit(50)]
+
+    @app.route('/')
+    def page():
+        logger.info('rendering the page')
+        items = cache.get('items')
+        if items is None:
+            items = load_items()
+            cache.set('items', items)
+        return render_template_string(
+            PAGE, title='Items (%.2f)' % total_price(items), items=items)
+
+    @app.route('/api/items')
+    def api():
+        return jsonify(items=load_items())
+
+    DebugToolbarExtension(app, cache)
+    return app
+
+
+def configurations(panels=None):
+    """The configurations benchmarked, as ``(name, config)`` pairs"""
+    defaults = DebugToolbarExtension()._default_config(Flask(__name__))
+    panels = panels or defaults['DEBUG_TB_PANELS']
+    # The panels finalized on the request thread, so that their cost is
+    # measured, and without a pool left behind by each configuration; the
+    # profiler active without the user activating it
+    common = {'DEBUG_TB_FINALIZE_WORKERS': 0,
+              'DEBUG_TB_PROFILER_ENABLED': True}
+    yield 'disabled', dict(common, DEBUG_TB_ENABLED=False)
+    for path in panels:
+        try:
+            import_string(path)
+        except ImportError:
+            logger.warning('Skipping %s, which cannot be imported', path)
+            continue
+        yield path.rsplit('.', 1)[-1], dict(common, DEBUG_TB_PANELS=(path,))
+    yield 'all', dict(common, DEBUG_TB_PANELS=tuple(panels))
+
+
+def run(config, requests=500, warmup=50, urls=('/', '/api/items')):
+    """Benchmark a configuration, returns its results in milliseconds,
+    requests per second and KiB"""
+    app = create_app(config)
+    client = app.test_client()
+    for i in range(warmup):
+        client.get(urls[i % len(urls)]).close()
+
+    # the panels to activate which are not, e.g. missing their dependency
+    inactive = []
+    with client:
+        client.get(urls[0]).close()
+        toolbar = current_toolbar()
+        if toolbar is not None:
+            inactive = [panel.name for panel in toolbar.panels
+                        if getattr(panel, 'user_activate', False) and
+                        not panel.is_active]
+
+    memory = None
+    if tracemalloc is not None:
+        # a pass of its own, tracing slows the requests down
+        gc.collect()
+        tracemalloc.start()
+        for i in range(min(requests, 100)):
+            client.get(urls[i % len(urls)]).close()
+        memory = tracemalloc.get_traced_memory()[1] / 1024.0
+        tracemalloc.stop()
+
+    durations = []
+    gc.collect()
+    started = perf_counter()
+    for i in range(requests):
+        start = perf_counter()
+        client.get(urls[i % len(urls)]).close()
+        durations.append(perf_counter() - start)
+    elapsed = perf_counter() - started
+
+    durations.sort()
+    return {
+        'requests': requests,
+        'mean': sum(durations) / len(durations) * 1000,
+        'p50': percentile(durations, 50) * 1000,
+        'p90': percentile(durations, 90) * 1000,
+        'p99': percentile(durations, 99) * 1000,
+        'throughput': requests / elapsed,
+        'memory': memory,
+        'inactive': inactive,
+    }
+
+
+def compare(results, baseline, tolerance):
+    """The configurations slower than in ``baseline``, as
+    ``(name, measure, baseline value, value)`` tuples"""
+    regressions = []
+    for name, result in results:
+        base = baseline.get(name)
+        if base is None:
+            continue
+        for measure in ('p50', 'p90'):
+            if result[measure] > base[measure] * (1 + tolerance):
+                regressions.append((name, measure, base[measure],
+                                    result[measure]))
+    return regressions
+
+
+def report(results, baseline=None, out=sys.stdout):
+    disabled = dict(results).get('disabled')
+    out.write('%-28s %9s %9s %9s %9s %9s %10s %10s\n' % (
+        'configuration', 'p50 ms', 'p90 ms', 'p99 ms', 'mean ms', 'req/s',
+        'mem KiB', 'overhead'))
+    for name, result in results:
+        overhead = ''
+        if disabled is not None and name != 'disabled':
+            overhead = '%+.3fms' % (result['p50'] - disabled['p50'])
+        memory = result['memory']
+        label = name
+        if result.get('inactive'):
+            label = '%s (inactive)' % name
+        out.write('%-28s %9.3f %9.3f %9.3f %9.3f %9.1f %10s %10s\n' % (
+            label, result['p50'], result['p90'], result['p99'], result['mean'],
+            result['throughput'],
+            '%.1f' % memory if memory is not None else '-', overhead))
+        base = (baseline or {}).get(name)
+        if base is not None:
+            out.write('%-28s %+8.1f%% %+8.1f%% %+8.1f%% %+8.1f%% %+8.1f%%\n' % (
+                '  vs baseline',
+                _change(base['p50'], result['p50']),
+                _change(base['p90'], result['p90']),
+                _change(base['p99'], result['p99']),
+                _change(base['mean'], result['mean']),
+                _change(base['throughput'], result['throughput'])))
+
+
+def _change(before, after):
+    return (after - before) * 100.0 / before if before else 0.0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m flask_debugtool.benchmark',
+        description="Measure the toolbar's overhead per panel.")
+    parser.add_argument('-n', '--requests', type=int, default=500,
+                        help='requests per configuration (500)')
+    parser.add_argument('--warmup', type=int, default=50,
+                        help='requests before measuring (50)')
+    parser.add_argument('--panel', action='append', dest='panels',
+                        help='dotted path of a panel to benchmark, instead '
+                             'of the default panels (repeatable)')
+    parser.add_argument('--baseline', help='JSON file of results to compare to')
+    parser.add_argument('--save', help='JSON file to write the results to')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='slowdown allowed against the baseline (0.1)')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    results = []
+    for name, config in configurations(args.panels):
+        results.append((name, run(config, args.requests, args.warmup)))
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as fp:
+            baseline = json.load(fp)
+    report(results, baseline)
+
+    if args.save:
+        with open(args.save, 'w') as fp:
+            json.dump(dict(results), fp, indent=2, sort_keys=True)
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.tolerance)
+        for name, measure, before, after in regressions:
+            sys.stdout.write('REGRESSION %s %s: %.3fms -> %.3fms\n' % (
+                name, measure, before, after))
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
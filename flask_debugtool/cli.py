@@ -0,0 +1,165 @@
+"""The ``flask debugtool`` commands"""
+import json
+import sys
+
+import click
+from flask.cli import pass_script_info
+
+from .toolbar import DebugToolbar, current_toolbar
+from .panels.template import TemplateDebugPanel
+from .utils import get_debug_queries
+
+# The panels the check reads its measures from
+CHECK_PANELS = (
+    'flask_debugtool.panels.timer.TimerDebugPanel',
+    'flask_debugtool.panels.template.TemplateDebugPanel',
+    'flask_debugtool.panels.sqlalchemy.SQLAlchemyDebugPanel',
+)
+
+# Measures which are counts: any increase is a regression
+COUNTS = ('queries', 'templates')
+TIMES = ('query_time', 'view_time')
+
+
+@click.group('debugtool')
+def debugtool():
+    """Commands of the debug toolbar."""
+
+
+def measure(client, url):
+    """Request ``url`` (``'/path'`` or ``'METHOD /path'``), returns its
+    status code and measures, times in milliseconds"""
+    method, _, path = url.rpartition(' ')
+    # the request context is kept until the next request, so that the
+    # toolbar of the request can be read
+    with client:
+        response = client.open(path, method=method or 'GET')
+        response.close()
+        toolbar = current_toolbar()
+        if toolbar is None:
+            raise click.ClickException('%s is not instrumented' % url)
+        queries = get_debug_queries() or ()
+        view_time = sum(end - start
+                        for category, name, start, end in toolbar.spans.spans
+                        if (category, name) == ('flask', 'view'))
+        panel = toolbar.get_panel(TemplateDebugPanel)
+        return response.status_code, {
+            'queries': len(queries),
+            'query_time': sum(query.duration for query in queries) * 1000,
+            'templates': len(panel.templates) if panel is not None else 0,
+            'view_time': view_time * 1000,
+        }
+
+
+def check_measures(measures, budget, baseline, tolerance):
+    """The measures over their budget or regressing from the baseline, as
+    messages"""
+    failures = []
+    for name in COUNTS + TIMES:
+        value = measures[name]
+        limit = budget.get(name)
+        if limit is not None and value > limit:
+            failures.append('%s %s over the budget of %s' % (
+                name, _format(name, value), _format(name, limit)))
+        if baseline is None or name not in baseline:
+            continue
+        allowed = baseline[name]
+        if name in TIMES:
+            allowed *= 1 + tolerance
+        if value > allowed:
+            failures.append('%s %s, was %s' % (
+                name, _format(name, value), _format(name, baseline[name])))
+    return failures
+
+
+def _format(name, value):
+    if name in TIMES:
+        return '%.2fms' % value
+    return '%d' % value
+
+
+@debugtool.command('check')
+@click.argument('urls', nargs=-1)
+@click.option('--baseline', type=click.Path(exists=True),
+              help='JSON file of measures to compare to.')
+@click.option('--save', type=click.Path(),
+              help='Write the measures to this JSON file.')
+@click.option('--repeat', default=5, show_default=True,
+              help='Requests per URL, times are their median.')
+@click.option('--tolerance', default=0.2, show_default=True,
+              help='Slowdown of the times allowed against the baseline.')
+@pass_script_info
+def check(info, urls, baseline, save, repeat, tolerance):
+    """Check the queries, query time, templates and view time of URLs.
+
+    The URLs (``/path`` or ``POST /path``) default to the keys of
+    ``DEBUG_TB_BUDGETS``, which maps them to their budget, e.g.
+    ``{'/': {'queries': 5, 'view_time': 200}}`` (times in milliseconds).
+    Exits with status 1 when a URL is over its budget, regressed from the
+    baseline or failed.
+    """
+    # without an application context of its own, so that each request
+    # gets one, with its own queries
+    app = info.load_app()
+    if 'debugtoolbar' not in app.extensions:
+        raise click.UsageError(
+            'The toolbar is disabled, set DEBUG_TB_ENABLED (or debug mode).')
+
+    budgets = app.config.get('DEBUG_TB_BUDGETS') or {}
+    urls = list(urls) or sorted(budgets)
+    if not urls:
+        raise click.UsageError('No URL given, nor in DEBUG_TB_BUDGETS.')
+    baselines = {}
+    if baseline:
+        with open(baseline) as fp:
+            baselines = json.load(fp)
+
+    # Set up the check panels, which may not be among the configured ones,
+    # e.g. the template panel connects its signal receivers there
+    extension = app.extensions['debugtoolbar']
+    for path in CHECK_PANELS:
+        panel_class = DebugToolbar._import_panel(app, path)
+        if panel_class is None:
+            raise click.ClickException('%s cannot be imported' % path)
+        panel_class.init_app(app, extension.jinja_env, extension.cache)
+
+    saved_config = dict((key, app.config[key]) for key in (
+        'DEBUG_TB_PANELS', 'DEBUG_TB_HOSTS', 'DEBUG_TB_INTERCEPT_REDIRECTS'))
+    app.config.update(DEBUG_TB_PANELS=CHECK_PANELS, DEBUG_TB_HOSTS=(),
+                      DEBUG_TB_INTERCEPT_REDIRECTS=False)
+    client = app.test_client()
+    results = {}
+    failed = False
+    try:
+        for url in urls:
+            # warms up the caches of the application, not measured
+            measure(client, url)
+            runs = [measure(client, url) for _ in range(max(repeat, 1))]
+            status_code = runs[-1][0]
+            measures = {}
+            for name in COUNTS:
+                measures[name] = max(run[1][name] for run in runs)
+            for name in TIMES:
+                values = sorted(run[1][name] for run in runs)
+                measures[name] = values[len(values) // 2]
+            results[url] = measures
+
+            failures = check_measures(measures, budgets.get(url, {}),
+                                      baselines.get(url), tolerance)
+            if status_code >= 400:
+                failures.insert(0, 'status %d' % status_code)
+            failed = failed or bool(failures)
+            click.echo('%s %s: %d queries (%.2fms), %d templates, view %.2fms' % (
+                'FAIL' if failures else 'ok  ', url, measures['queries'],
+                measures['query_time'], measures['templates'],
+                measures['view_time']))
+            for failure in failures:
+                click.echo('     %s' % failure)
+    finally:
+        app.config.update(saved_config)
+
+    if save:
+        with open(save, 'w') as fp:
+            json.dump(results, fp, indent=2, sort_keys=True)
+    if failed:
+        sys.exit(1)
@@ -1,9 +1,15 @@
 import sys
+import time
 
 PY2 = sys.version_info[0] == 2
 
 
 if PY2:
     iteritems = lambda d: d.iteritems()
+    from thread import get_ident
 else:
     iteritems = lambda d: iter(d.items())
+    from threading import get_ident
+
+# A monotonic clock with the best available resolution for timing spans
+perf_counter = getattr(time, 'perf_counter', time.time)
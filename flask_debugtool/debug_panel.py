@@ -1,6 +1,7 @@
 __author__ = 'lufeng'
 
 """Base DebugPanel class"""
+from .utils import cache_key
 
 
 class DebugPanel(object):
@@ -13,13 +14,17 @@ class DebugPanel(object):
     # If the client is able to activate/de-activate the panel
     user_enable = False
 
-    # We'll maintain a local context instance so we can expose our template
-    # context variables to panels which need them:
+    # We'll maintain a context per panel instance so we can expose our
+    # template context variables to panels which need them:
     context = {}
 
+    # Id of the toolbar (and so of the request) this panel belongs to, set
+    # by the toolbar when the panel is created
+    request_id = None
+
     # Panel methods
     def __init__(self, jinja_env, context={}, cache=None):
-        self.context.update(context)
+        self.context = dict(context)
         self.jinja_env = jinja_env
         self.cache = cache
 
@@ -30,6 +35,27 @@ class DebugPanel(object):
         template = self.jinja_env.get_template(template_name)
         return template.render(**context)
 
+    @classmethod
+    def init_app(cls, app, jinja_env, cache=None):
+        """
+        Called once when the extension is initialized for ``app``, to set up
+        what the panel shares between requests, e.g. templates registered
+        in the toolbar's ``jinja_env`` or hooks on the ``cache`` extension
+        """
+        pass
+
+    @classmethod
+    def stored_content(cls, jinja_env, info, summary):
+        """
+        The content of a panel of an earlier request, rendered from what it
+        stored (``render_cache``) and the summary of the request, which may
+        have gained data since, e.g. its WSGI timings
+        """
+        return info.get('content', '')
+
+    def cache_key(self):
+        return cache_key(self.request_id, self.name)
+
     def dom_id(self):
         return 'flDebug%sPanel' % (self.name.replace(' ', ''))
 
@@ -59,4 +85,18 @@ class DebugPanel(object):
         pass
 
     def process_response(self, request, response):
-        pass
\ No newline at end of file
+        """
+        Capture what the panel shows of the request, cheaply: it runs on
+        the request thread, before the response is sent
+        """
+        pass
+
+    def finalize(self):
+        """
+        The heavy part of processing the response, from what
+        ``process_response`` captured: formatting, rendering the content to
+        the cache. It may run on another thread after the response was
+        sent, with an application context but no request context.
+        """
+        if self.cache and self.has_content:
+            self.cache.set(self.cache_key(), self.render_cache())
@@ -0,0 +1,74 @@
+"""Post-processing of the panels, off the request thread"""
+import os
+import threading
+
+try:
+    from concurrent.futures import ThreadPoolExecutor, TimeoutError
+except ImportError:
+    # Python 2 without the futures backport: finalized on the request thread
+    ThreadPoolExecutor = None
+
+
+class Finalizer(object):
+    """
+    Runs the finalize step of the toolbars on a pool of ``max_workers``
+    threads, once their response is on its way. Past ``max_pending``
+    toolbars waiting for the pool, they are finalized on the request thread
+    instead, so that a burst of requests doesn't pile up unbounded work.
+    """
+
+    def __init__(self, max_workers=2, max_pending=100):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.lock = threading.Lock()
+        # futures of the toolbars being finalized, by request id
+        self.pending = {}
+        self.executor = None
+        self.pid = None
+
+    @property
+    def enabled(self):
+        return ThreadPoolExecutor is not None and self.max_workers > 0
+
+    def submit(self, request_id, func):
+        """Call ``func`` on the pool, or right away if it is full"""
+        future = None
+        if self.enabled:
+            with self.lock:
+                if len(self.pending) < self.max_pending:
+                    future = self._ensure_executor().submit(func)
+                    self.pending[request_id] = future
+        if future is None:
+            func()
+            return
+        # outside of the lock, called right away if already done
+        future.add_done_callback(
+            lambda future: self._done(request_id, future))
+
+    def _done(self, request_id, future):
+        with self.lock:
+            if self.pending.get(request_id) is future:
+                del self.pending[request_id]
+
+    def wait(self, request_id, timeout):
+        """
+        Wait for the toolbar of a request to be finalized, at most
+        ``timeout`` seconds. Returns right away for the requests which are
+        not pending (done, or served by another process).
+        """
+        with self.lock:
+            future = self.pending.get(request_id)
+        if future is None:
+            return
+        try:
+            future.result(timeout)
+        except TimeoutError:
+            pass
+
+    def _ensure_executor(self):
+        # The threads don't survive a fork, e.g. into pre-forked workers
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.pending = {}
+            self.executor = ThreadPoolExecutor(self.max_workers)
+        return self.executor
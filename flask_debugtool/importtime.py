@@ -0,0 +1,143 @@
+"""
+Import times of the modules, recorded in process as ``-X importtime`` does.
+
+Only the standard library is imported here, so that recording can start
+before the application and its dependencies are imported: either call
+``install()`` first thing in the entry point of the application, or set the
+``FLASK_DEBUGTOOL_IMPORTTIME`` environment variable and import
+``flask_debugtool`` first, which installs it before importing Flask.
+"""
+import os
+import sys
+import threading
+import time
+
+from .compat import PY2, perf_counter
+
+try:
+    from importlib.machinery import (ExtensionFileLoader, SourceFileLoader,
+                                     SourcelessFileLoader)
+    # Loaders created for each module, which can be wrapped per module
+    _TIMED_LOADERS = (ExtensionFileLoader, SourceFileLoader,
+                      SourcelessFileLoader)
+except ImportError:
+    _TIMED_LOADERS = ()
+
+ENV_VAR = 'FLASK_DEBUGTOOL_IMPORTTIME'
+
+recorder = None
+
+
+def install():
+    """Start recording the imports, returns the recorder (None on Python 2,
+    which doesn't have the import hooks needed)"""
+    global recorder
+    if recorder is None and not PY2:
+        recorder = ImportRecorder()
+        sys.meta_path.insert(0, recorder)
+    return recorder
+
+
+def process_start():
+    """Wall clock time at which the process started, None if unknown"""
+    try:
+        with open('/proc/self/stat') as fp:
+            # the fields after the command, which can contain spaces
+            fields = fp.read().rsplit(')', 1)[1].split()
+        with open('/proc/uptime') as fp:
+            uptime = float(fp.read().split()[0])
+        ticks = os.sysconf('SC_CLK_TCK')
+    except (IOError, OSError, ValueError, IndexError, AttributeError):
+        return None
+    return time.time() - uptime + int(fields[19]) / float(ticks)
+
+
+class ImportRecord(object):
+    """The import of a module: when it started, after the start of the
+    process, and its own and cumulative durations, in seconds"""
+    __slots__ = ('name', 'parent', 'depth', 'start', 'self_time',
+                 'cumulative', 'children')
+
+    def __init__(self, name, parent, depth, start):
+        self.name = name
+        self.parent = parent
+        self.depth = depth
+        self.start = start
+        self.self_time = 0.0
+        self.cumulative = 0.0
+        self.children = 0.0
+
+
+class ImportRecorder(object):
+    """
+    Finder first on ``sys.meta_path``, which finds the modules with the
+    other finders and times the execution of those loaded from files. The
+    modules a module imports while it runs are its children: its self time
+    excludes theirs, its cumulative time includes them.
+    """
+
+    def __init__(self):
+        now = perf_counter()
+        started = process_start()
+        # the perf_counter() of the start of the process, or else of now
+        self.origin = now - (time.time() - started) if started else now
+        self.installed = now - self.origin
+        self.preloaded = len(sys.modules)
+        # in the order the imports finished
+        self.records = []
+        # sum of their self times
+        self.total = 0.0
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def _stack(self):
+        stack = getattr(self.local, 'stack', None)
+        if stack is None:
+            stack = self.local.stack = []
+        return stack
+
+    def find_spec(self, fullname, path=None, target=None):
+        local = self.local
+        if getattr(local, 'finding', False):
+            return None
+        local.finding = True
+        start = perf_counter()
+        try:
+            for finder in sys.meta_path:
+                find_spec = getattr(finder, 'find_spec', None)
+                if finder is self or find_spec is None:
+                    continue
+                spec = find_spec(fullname, path, target)
+                if spec is not None:
+                    break
+            else:
+                return None
+        finally:
+            local.finding = False
+        if isinstance(spec.loader, _TIMED_LOADERS):
+            self._wrap(spec.loader, fullname, start)
+        return spec
+
+    def _wrap(self, loader, name, start):
+        exec_module = loader.exec_module
+
+        def timed_exec_module(module):
+            stack = self._stack()
+            parent = stack[-1] if stack else None
+            record = ImportRecord(name, parent and parent.name, len(stack),
+                                  start - self.origin)
+            stack.append(record)
+            try:
+                exec_module(module)
+            finally:
+                stack.pop()
+                # from the start of the search of the module
+                record.cumulative = perf_counter() - start
+                record.self_time = record.cumulative - record.children
+                if parent is not None:
+                    parent.children += record.cumulative
+                with self.lock:
+                    self.records.append(record)
+                    self.total += record.self_time
+                del loader.exec_module
+        loader.exec_module = timed_exec_module
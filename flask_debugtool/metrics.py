@@ -0,0 +1,269 @@
+"""Counters and histograms of the requests, exposed as OpenMetrics text"""
+import atexit
+import bisect
+import errno
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+try:
+    import resource
+    RUSAGE_WHO = getattr(resource, 'RUSAGE_THREAD', resource.RUSAGE_SELF)
+except ImportError:
+    resource = None  # Will fail on Win32 systems
+
+from .compat import iteritems
+
+CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+DURATION_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+# name: (type, help, buckets)
+METRICS = {
+    'flask_debugtool_request_duration_seconds': (
+        'histogram', 'Time spent handling the request', DURATION_BUCKETS),
+    'flask_debugtool_request_cpu_seconds': (
+        'histogram', 'CPU time used handling the request', DURATION_BUCKETS),
+    'flask_debugtool_request_queries': (
+        'histogram', 'SQL queries made by the request', COUNT_BUCKETS),
+    'flask_debugtool_request_query_duration_seconds': (
+        'histogram', 'Time spent in SQL queries by the request',
+        DURATION_BUCKETS),
+    'flask_debugtool_request_templates': (
+        'histogram', 'Templates rendered by the request', COUNT_BUCKETS),
+    'flask_debugtool_log_records': (
+        'counter', 'Log records emitted', None),
+}
+
+
+def cpu_time():
+    """CPU time used so far by the current thread (or process)"""
+    if resource is None:
+        return 0.0
+    usage = resource.getrusage(RUSAGE_WHO)
+    return usage.ru_utime + usage.ru_stime
+
+
+def process_alive(pid):
+    """If the process ``pid`` still runs, assumed where it can't be told"""
+    if os.name != 'posix':
+        return True  # os.kill() would terminate it
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno != errno.ESRCH
+    return True
+
+
+def escape_label(value):
+    return (str(value).replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n'))
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, escape_label(value))
+                             for name, value in labels)
+
+
+def format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+class LogCounter(logging.Handler):
+    """Logging handler counting the records per level"""
+
+    def __init__(self, registry):
+        logging.Handler.__init__(self)
+        self.registry = registry
+
+    def emit(self, record):
+        self.registry.inc('flask_debugtool_log_records',
+                          (('level', record.levelname),))
+
+
+class MetricsRegistry(object):
+    """
+    Counters and histograms of this process.
+
+    Updating a series is a few operations under a lock, and rendering is
+    O(series) whatever the number of requests. When a ``directory`` is
+    set, each process (e.g. pre-forked workers) writes its values there at
+    most every ``flush_interval`` seconds, and rendering sums the values of
+    all the processes found there. A process removes its file when it
+    exits, and the files of the processes which no longer run (e.g. killed
+    workers) are removed when rendering, their values with them.
+    """
+
+    def __init__(self, directory=None, flush_interval=1.0):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self._reset()
+        if directory is not None:
+            atexit.register(self.remove)
+
+    def _reset(self):
+        self.pid = os.getpid()
+        # {(name, labels): value}, labels being a tuple of (name, value)
+        self.counters = {}
+        # {(name, labels): [count per bucket..., above the last bucket,
+        #                   count, sum]}
+        self.histograms = {}
+        self.filename = None
+        self.last_flush = 0
+        self.dirty = False
+
+    def _check_pid(self):
+        # A forked worker starts from scratch, its parent's values are
+        # accounted by the parent
+        if os.getpid() != self.pid:
+            self._reset()
+
+    def inc(self, name, labels=(), value=1):
+        with self.lock:
+            self._check_pid()
+            key = (name, labels)
+            self.counters[key] = self.counters.get(key, 0) + value
+            self.dirty = True
+
+    def observe(self, name, labels, value):
+        buckets = METRICS[name][2]
+        with self.lock:
+            self._check_pid()
+            key = (name, labels)
+            series = self.histograms.get(key)
+            if series is None:
+                series = self.histograms[key] = [0] * (len(buckets) + 3)
+            series[bisect.bisect_left(buckets, value)] += 1
+            series[-2] += 1
+            series[-1] += value
+            self.dirty = True
+
+    def snapshot(self):
+        with self.lock:
+            self._check_pid()
+            return {
+                'counters': [[name, list(labels), value] for (name, labels), value
+                             in iteritems(self.counters)],
+                'histograms': [[name, list(labels), list(series)]
+                               for (name, labels), series
+                               in iteritems(self.histograms)],
+            }
+
+    def maybe_flush(self):
+        """Write the values of this process to the directory if due"""
+        if self.directory is None or not self.dirty:
+            return
+        if time.time() - self.last_flush < self.flush_interval:
+            return
+        self.flush()
+
+    def flush(self):
+        if self.directory is None:
+            return
+        snapshot = self.snapshot()
+        with self.lock:
+            if self.filename is None:
+                self.filename = os.path.join(
+                    self.directory, 'metrics-%d-%s.json' % (
+                        self.pid, uuid.uuid4().hex[:8]))
+            filename = self.filename
+            self.last_flush = time.time()
+            self.dirty = False
+        tmp_filename = '%s.tmp' % filename
+        with open(tmp_filename, 'w') as fp:
+            json.dump(snapshot, fp)
+        os.rename(tmp_filename, filename)
+
+    def remove(self):
+        """Remove the file of this process from the directory"""
+        with self.lock:
+            filename = self.filename
+            if filename is None or os.getpid() != self.pid:
+                return  # a forked worker which never flushed
+            self.filename = None
+        try:
+            os.remove(filename)
+        except OSError:
+            pass
+
+    def collect(self):
+        """Return the values of all processes, summed per series"""
+        if self.directory is None:
+            snapshots = [self.snapshot()]
+        else:
+            self.flush()
+            snapshots = []
+            for name in os.listdir(self.directory):
+                if not (name.startswith('metrics-') and name.endswith('.json')):
+                    continue
+                try:
+                    pid = int(name.split('-')[1])
+                except ValueError:
+                    continue
+                if not process_alive(pid):
+                    try:
+                        os.remove(os.path.join(self.directory, name))
+                    except OSError:
+                        pass  # removed by another process
+                    continue
+                try:
+                    with open(os.path.join(self.directory, name)) as fp:
+                        snapshots.append(json.load(fp))
+                except (IOError, OSError, ValueError):
+                    continue
+
+        counters = {}
+        histograms = {}
+        for snapshot in snapshots:
+            for name, labels, value in snapshot['counters']:
+                key = (name, tuple(tuple(label) for label in labels))
+                counters[key] = counters.get(key, 0) + value
+            for name, labels, series in snapshot['histograms']:
+                key = (name, tuple(tuple(label) for label in labels))
+                if key in histograms:
+                    histograms[key] = [a + b for a, b
+                                       in zip(histograms[key], series)]
+                else:
+                    histograms[key] = series
+        return counters, histograms
+
+    def render(self):
+        """Render all the series in the OpenMetrics text format"""
+        counters, histograms = self.collect()
+        by_name = {}
+        for (name, labels), value in iteritems(counters):
+            by_name.setdefault(name, []).append((labels, value))
+        for (name, labels), series in iteritems(histograms):
+            by_name.setdefault(name, []).append((labels, series))
+
+        lines = []
+        for name in sorted(by_name):
+            kind, help, buckets = METRICS[name]
+            lines.append('# TYPE %s %s' % (name, kind))
+            lines.append('# HELP %s %s' % (name, help))
+            for labels, value in sorted(by_name[name]):
+                if kind == 'counter':
+                    lines.append('%s_total%s %s' % (
+                        name, format_labels(labels), format_value(value)))
+                    continue
+                cumulative = 0
+                bounds = [format_value(float(b)) for b in buckets] + ['+Inf']
+                for bound, count in zip(bounds, value):
+                    cumulative += count
+                    lines.append('%s_bucket%s %d' % (
+                        name, format_labels(labels + (('le', bound),)),
+                        cumulative))
+                lines.append('%s_count%s %d' % (
+                    name, format_labels(labels), value[-2]))
+                lines.append('%s_sum%s %s' % (
+                    name, format_labels(labels), format_value(value[-1])))
+        lines.append('# EOF')
+        return '\n'.join(lines) + '\n'
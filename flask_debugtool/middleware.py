@@ -0,0 +1,85 @@
+"""WSGI middleware timing what happens outside of the Flask request cycle"""
+import logging
+
+from .compat import perf_counter
+
+# Set by the extension in the WSGI environ, the endpoint of the request
+ENDPOINT_KEY = 'flask_debugtool.endpoint'
+
+# Name under which the timings of a request are stored next to its panels'
+# data, see ``cache_key``
+WSGI_NAME = 'wsgi'
+
+logger = logging.getLogger('flask_debugtool.middleware')
+
+
+class WSGITimingMiddleware(object):
+    """
+    Wraps ``app.wsgi_app`` to measure, for each response, the total time
+    until the server closed it, the time to its first body byte, the time
+    spent iterating its body (e.g. streamed responses) and the bytes sent.
+    Each measure is handed to ``on_response(environ, request_id,
+    status_code, timings)``, ``request_id`` being the toolbar id of the
+    request or None.
+    """
+
+    def __init__(self, wsgi_app, request_id_header, on_response):
+        self.wsgi_app = wsgi_app
+        self.request_id_header = request_id_header.lower()
+        self.on_response = on_response
+
+    def __call__(self, environ, start_response):
+        start = perf_counter()
+        response = {'status_code': None, 'request_id': None}
+
+        def timed_start_response(status, headers, exc_info=None):
+            response['status_code'] = int(status.split(None, 1)[0])
+            for name, value in headers:
+                if name.lower() == self.request_id_header:
+                    response['request_id'] = value
+            if exc_info is not None:
+                return start_response(status, headers, exc_info)
+            return start_response(status, headers)
+
+        app_iter = self.wsgi_app(environ, timed_start_response)
+        return TimedResponse(app_iter, start, perf_counter(),
+                             lambda timings: self.on_response(
+                                 environ, response['request_id'],
+                                 response['status_code'], timings))
+
+
+class TimedResponse(object):
+    """Iterates over the body of a response, timing it until closed"""
+
+    def __init__(self, app_iter, start, returned, on_close):
+        self.app_iter = app_iter
+        self.start = start
+        self.returned = returned
+        self.first_byte = None
+        self.bytes_sent = 0
+        self.on_close = on_close
+
+    def __iter__(self):
+        for chunk in self.app_iter:
+            if chunk and self.first_byte is None:
+                self.first_byte = perf_counter()
+            self.bytes_sent += len(chunk)
+            yield chunk
+
+    def close(self):
+        try:
+            if hasattr(self.app_iter, 'close'):
+                self.app_iter.close()
+        finally:
+            end = perf_counter()
+            # called by the server, which mustn't fail because of the toolbar
+            try:
+                self.on_close({
+                    'total': end - self.start,
+                    'app': self.returned - self.start,
+                    'ttfb': (self.first_byte or end) - self.start,
+                    'body': end - self.returned,
+                    'bytes_sent': self.bytes_sent,
+                })
+            except Exception:
+                logger.exception('Cannot record the timings of a response')
@@ -0,0 +1,172 @@
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from ..compat import perf_counter
+from ..debug_panel import DebugPanel
+from ..spans import current_spans
+from ..toolbar import current_toolbar
+from ..utils import format_fname, get_call_site
+
+_ = lambda x: x
+
+# Modules skipped when looking for the code which used the cache
+CACHE_MODULES = ('werkzeug.contrib.cache', 'flask_cache', 'flask_caching',
+                 'cachelib')
+
+# Keys of the toolbar's own data, which isn't shown
+TOOLBAR_KEY_PREFIX = 'DEBUGTOOLBAR:'
+
+
+def _current_panel():
+    toolbar = current_toolbar()
+    return toolbar and toolbar.get_panel(CacheDebugPanel)
+
+
+def value_size(value):
+    """Approximate size of a cached value, as pickled by most backends"""
+    if isinstance(value, bytes):
+        return len(value)
+    try:
+        return len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+    except Exception:
+        return None
+
+
+class CacheDebugPanel(DebugPanel):
+    """
+    Panel that displays the accesses to the cache extension given to
+    DebugToolbarExtension, flagging repeated and batchable gets.
+    """
+    name = 'Cache'
+    has_content = True
+
+    def __init__(self, *args, **kwargs):
+        super(CacheDebugPanel, self).__init__(*args, **kwargs)
+        self.calls = []
+        # set while a call is traced, the cache's own get_many may be
+        # implemented with get
+        self.tracing = False
+
+    @classmethod
+    def init_app(cls, app, jinja_env, cache=None):
+        if cache is None or getattr(cache, '_fldt_traced', False):
+            return
+        cache._fldt_traced = True
+        for method in ('get', 'set', 'get_many', 'delete'):
+            setattr(cache, method, _traced(method, getattr(cache, method)))
+
+    def record(self, method, keys, result, duration):
+        filename, lineno, function = get_call_site(CACHE_MODULES)
+        spans = current_spans()
+        if spans is not None:
+            end = perf_counter()
+            spans.add('cache', '%s %s' % (method, ' '.join(map(str, keys))[:100]),
+                      end - duration, end)
+        if method == 'get':
+            hits = 0 if result is None else 1
+            size = None if result is None else value_size(result)
+        elif method == 'get_many':
+            hits = sum(1 for value in result if value is not None)
+            sizes = [value_size(value) for value in result if value is not None]
+            size = sum(s for s in sizes if s is not None)
+        else:
+            hits = None
+            size = value_size(result) if method == 'set' else None
+        self.calls.append({
+            'method': method,
+            'keys': keys,
+            'hits': hits,
+            'duration': duration,
+            'size': size,
+            'repeated': False,
+            'batchable': False,
+            'context': format_fname(filename),
+            'context_long': '%s:%d (%s)' % (filename, lineno, function),
+        })
+
+    def flag_calls(self):
+        """
+        Flag gets of a key already got earlier in the request, and runs of
+        single key gets which could have been a single get_many
+        """
+        seen = set()
+        run = []
+        for call in self.calls + [None]:
+            if call is not None and call['method'] == 'get':
+                key = call['keys'][0]
+                call['repeated'] = key in seen
+                seen.add(key)
+                run.append(call)
+                continue
+            if len(run) > 1:
+                for get in run:
+                    get['batchable'] = True
+            run = []
+            if call is not None and call['method'] == 'get_many':
+                seen.update(call['keys'])
+            elif call is not None:
+                # the value changed, getting it again is fine
+                seen.difference_update(call['keys'])
+
+    def process_response(self, request, response):
+        self.flag_calls()
+
+    def render_cache(self):
+        return {"title": self.title(), "nav_subtitile": self.nav_subtitle(), "content": self.content()}
+
+    def nav_title(self):
+        return _('Cache')
+
+    def nav_subtitle(self):
+        count = len(self.calls)
+        total = sum(call['duration'] for call in self.calls)
+        return '%d %s in %.2fms' % (count, 'call' if count == 1 else 'calls',
+                                    total * 1000)
+
+    def title(self):
+        return _('Cache calls')
+
+    def url(self):
+        return ''
+
+    def content(self):
+        gets = [c for c in self.calls if c['method'] in ('get', 'get_many')]
+        return self.render('panels/cache.html', {
+            'calls': self.calls,
+            'hits': sum(c['hits'] for c in gets),
+            'misses': sum(len(c['keys']) - c['hits'] for c in gets),
+            'repeated': sum(1 for c in self.calls if c['repeated']),
+            'batchable': sum(1 for c in self.calls if c['batchable']),
+        })
+
+
+def _traced(method, func):
+    def wrapper(*args, **kwargs):
+        panel = _current_panel()
+        if panel is None or panel.tracing:
+            return func(*args, **kwargs)
+        if method == 'get_many':
+            keys = list(args)
+        else:
+            keys = list(args[:1]) or [kwargs.get('key')]
+        if any(str(key).startswith(TOOLBAR_KEY_PREFIX) for key in keys):
+            return func(*args, **kwargs)
+
+        panel.tracing = True
+        start = perf_counter()
+        try:
+            result = func(*args, **kwargs)
+        finally:
+            duration = perf_counter() - start
+            panel.tracing = False
+        if method == 'set':
+            value = args[1] if len(args) > 1 else kwargs.get('value')
+            panel.record(method, keys, value, duration)
+        else:
+            panel.record(method, keys, result, duration)
+        return result
+    wrapper.__name__ = func.__name__
+    wrapper.__doc__ = func.__doc__
+    return wrapper
@@ -20,6 +20,9 @@ class ConfigVarsDebugPanel(DebugPanel):
     def url(self):
         return ''
 
+    def render_cache(self):
+        return {"title": self.title(), "nav_subtitile": self.nav_subtitle(), "content": self.content()}
+
     def content(self):
         context = self.context.copy()
         context.update({
@@ -47,8 +47,6 @@ class HeaderDebugPanel(DebugPanel):
             [(k, request.environ[k])
                 for k in self.header_filter if k in request.environ]
         )
-        if self.cache:
-            self.cache.set("DEBUGTOOLBAR:%s" % self.name, self.render_cache())
 
     def render_cache(self):
         return {"title": self.title(), "nav_subtitile": self.nav_subtitle(), "content": self.content()}
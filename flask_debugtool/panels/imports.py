@@ -0,0 +1,77 @@
+import heapq
+
+from flask import current_app
+
+from .. import importtime
+from ..debug_panel import DebugPanel
+
+_ = lambda x: x
+
+
+class ImportTimeDebugPanel(DebugPanel):
+    """
+    Panel that displays the slowest imports of the process, by their own
+    time and by the time of their subtree, and the imports made by the
+    request. The imports are only recorded once ``importtime.install()``
+    ran, see ``flask_debugtool.importtime``.
+    """
+    name = 'ImportTime'
+    has_content = True
+
+    def __init__(self, *args, **kwargs):
+        DebugPanel.__init__(self, *args, **kwargs)
+        self.recorder = importtime.recorder
+        self.first = self.count = 0
+        self.total = 0.0
+
+    def process_request(self, request):
+        if self.recorder is not None:
+            self.first = len(self.recorder.records)
+
+    def process_response(self, request, response):
+        recorder = self.recorder
+        if recorder is not None:
+            with recorder.lock:
+                self.count = len(recorder.records)
+                self.total = recorder.total
+
+    def finalize(self):
+        recorder = self.recorder
+        if recorder is not None:
+            records = recorder.records[:self.count]
+            max_rows = current_app.config.get('DEBUG_TB_IMPORTTIME_MAX_ROWS', 50)
+            self.slowest = heapq.nlargest(
+                max_rows, records, key=lambda record: record.self_time)
+            self.subtrees = heapq.nlargest(
+                max_rows, records, key=lambda record: record.cumulative)
+            self.request_imports = records[self.first:]
+        super(ImportTimeDebugPanel, self).finalize()
+
+    def render_cache(self):
+        return {"title": self.title(), "nav_subtitile": self.nav_subtitle(), "content": self.content()}
+
+    def nav_title(self):
+        return _('Imports')
+
+    def nav_subtitle(self):
+        if self.recorder is None:
+            return _('not recorded')
+        return '%d modules in %.0fms' % (self.count, self.total * 1000)
+
+    def title(self):
+        return _('Import times')
+
+    def url(self):
+        return ''
+
+    def content(self):
+        if self.recorder is None:
+            return self.render('panels/imports.html', {'recorder': None})
+        return self.render('panels/imports.html', {
+            'recorder': self.recorder,
+            'count': self.count,
+            'total': self.total,
+            'slowest': self.slowest,
+            'subtrees': self.subtrees,
+            'request_imports': self.request_imports,
+        })
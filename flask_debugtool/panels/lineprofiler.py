@@ -1,10 +1,11 @@
-import line_profiler
 import functools
 import inspect
 import linecache
 import collections
-import __builtin__
-import jinja2
+try:
+    import builtins
+except ImportError:
+    import __builtin__ as builtins
 
 from ..debug_panel import DebugPanel
 
@@ -30,8 +31,6 @@ def line_profile(f):
     functions_to_profile.append(f)
     return f
 
-__builtin__.__dict__["profile"] = line_profile
-
 
 def process_line_stats(line_stats):
     "Converts line_profiler.LineStats instance into something more useful"
@@ -65,6 +64,9 @@ def process_line_stats(line_stats):
             nhits, time = line_to_timing[lineno]
             padded_timings.append( (lineno, nhits, time) )
 
+        lines = [line.decode("utf8") if isinstance(line, bytes) else line
+                 for line in all_lines]
+
         profile_results.append({
             'filename': filename,
             'start_lineno': start_lineno,
@@ -72,7 +74,7 @@ def process_line_stats(line_stats):
             'timings': [
                 (
                     lineno,
-                    unicode(all_lines[lineno - 1].decode("utf8")),
+                    lines[lineno - 1],
                     time * multiplier,
                     nhits,
                 ) for (lineno, nhits, time) in padded_timings
@@ -91,27 +93,38 @@ class LineProfilerPanel(DebugPanel):
 
     def __init__(self, jinja_env, context={}, cache=None):
         DebugPanel.__init__(self, jinja_env, context=context, cache=cache)
-        self.jinja_env.loader = jinja2.ChoiceLoader([
-            self.jinja_env.loader,
-            jinja2.PrefixLoader({
-                'lineprofiler': jinja2.PackageLoader(__name__, 'templates')
-            })
-        ])
 
         if functions_to_profile:
             self.is_active = True
+        self.missing = False
+
+    @classmethod
+    def init_app(cls, app, jinja_env, cache=None):
+        # Rather than when imported, only once the panel is used
+        builtins.__dict__["profile"] = line_profile
 
     def has_content(self):
         return bool(self.profiler)
 
     def process_request(self, request):
+        self.profiler = None
+        self.stats = None
+        self.line_stats = []
+        if not self.is_active:
+            return
+
+        # Imported once functions are profiled, it isn't needed before
+        try:
+            import line_profiler
+        except ImportError:
+            self.is_active = False
+            self.missing = True
+            return
         self.profiler = line_profiler.LineProfiler()
 
         for f in functions_to_profile:
             self.profiler.add_function(f)
 
-        self.stats = None
-
     def process_view(self, request, view_func, view_kwargs):
         if self.is_active:
             return functools.partial(self.profiler.runcall, view_func)
@@ -120,10 +133,13 @@ class LineProfilerPanel(DebugPanel):
         if not self.is_active:
             return False
         self.stats = self.profiler.get_stats()
-        if self.cache and process_line_stats(self.stats):
-            self.cache.set("DEBUGTOOLBAR:%s" % self.name, self.render_cache())
         return response
 
+    def finalize(self):
+        self.line_stats = process_line_stats(self.stats)
+        if self.line_stats:
+            super(LineProfilerPanel, self).finalize()
+
     def title(self):
         if not self.is_active:
             return 'Line Profiler Usage Docs'
@@ -134,6 +150,8 @@ class LineProfilerPanel(DebugPanel):
         return 'Line Profiler'
 
     def nav_subtitle(self):
+        if self.missing:
+            return "line_profiler is not installed"
         if not self.is_active:
             return "Click for Usage Docs"
 
@@ -146,7 +164,6 @@ class LineProfilerPanel(DebugPanel):
         return {"title": self.title(), "nav_subtitile": self.nav_subtitle(), "content": self.content()}
 
     def content(self):
-        processed_line_stats = process_line_stats(self.stats)
         return self.render('panels/lineprofiler.html', {
-            'stats': processed_line_stats
+            'stats': self.line_stats
         })
@@ -7,7 +7,11 @@ try:
 except ImportError:
     threading = None
 
-import DebugPanel
+from werkzeug.local import Local, release_local
+
+from ..debug_panel import DebugPanel
+from ..spans import current_spans
+from ..toolbar import current_toolbar
 from ..utils import format_fname
 
 _ = lambda x: x
@@ -19,27 +23,28 @@ class ThreadTrackingHandler(logging.Handler):
             raise NotImplementedError("threading module is not available, \
                 the logging panel cannot be used without it")
         logging.Handler.__init__(self)
-        self.records = {}  # a dictionary that maps threads to log records
+        # the log records of the current thread, or greenlet when the
+        # requests are served by greenlets
+        self.local = Local()
 
     def emit(self, record):
-        self.get_records().append(record)
+        # only keep the records of instrumented requests, nothing would
+        # ever clear the others
+        if current_toolbar() is not None:
+            self.get_records().append(record)
 
-    def get_records(self, thread=None):
+    def get_records(self):
         """
-        Returns a list of records for the provided thread, of if none is provided,
-        returns a list for the current thread.
+        Returns a list of records for the current thread (or greenlet).
         """
-        if thread is None:
-            thread = threading.currentThread()
-        if thread not in self.records:
-            self.records[thread] = []
-        return self.records[thread]
+        try:
+            return self.local.records
+        except AttributeError:
+            records = self.local.records = []
+            return records
 
-    def clear_records(self, thread=None):
-        if thread is None:
-            thread = threading.currentThread()
-        if thread in self.records:
-            del self.records[thread]
+    def clear_records(self):
+        release_local(self.local)
 
 
 handler = None
@@ -73,6 +78,7 @@ def _init_once():
 class LoggingPanel(DebugPanel):
     name = 'Logging'
     has_content = True
+    records = ()
 
     def process_request(self, request):
         _init_once()
@@ -85,7 +91,11 @@ class LoggingPanel(DebugPanel):
 
     def process_response(self, request, response):
         records = []
+        spans = current_spans()
         for record in self.get_and_delete():
+            if spans is not None:
+                spans.add_wall('log', '%s: %s' % (
+                    record.levelname, record.getMessage()[:100]), record.created)
             records.append({
                 'message': record.getMessage(),
                 'time': datetime.datetime.fromtimestamp(record.created),
@@ -95,10 +105,9 @@ class LoggingPanel(DebugPanel):
                 'line': record.lineno,
             })
 
+        self.records = records
         self.data = self.context.copy()
         self.data.update({'records': records})
-        if self.cache:
-            self.cache.set("DEBUGTOOLBAR:%s" % self.name, self.render_cache())
 
     def nav_title(self):
         return _("Logging")
@@ -106,7 +115,7 @@ class LoggingPanel(DebugPanel):
     def nav_subtitle(self):
         # FIXME l10n: use ngettext
         return "%s message%s" % \
-            (len(handler.get_records()), (len(handler.get_records()) == 1) and '' or 's')
+            (len(self.records), (len(self.records) == 1) and '' or 's')
 
     def title(self):
         return _('Log Messages')
@@ -0,0 +1,274 @@
+import socket
+import threading
+try:
+    import http.client as httplib
+except ImportError:
+    import httplib
+try:
+    import ssl
+except ImportError:
+    ssl = None
+try:
+    import urllib3.connection as urllib3_connection
+except ImportError:
+    urllib3_connection = None
+
+from ..compat import perf_counter
+from ..debug_panel import DebugPanel
+from ..spans import current_spans
+from ..toolbar import current_toolbar
+from ..utils import format_fname, get_call_site
+
+_ = lambda x: x
+
+# Modules skipped when looking for the code which made the call
+CLIENT_MODULES = ('http.client', 'httplib', 'urllib', 'urllib2', 'urllib3',
+                  'requests', 'socket', 'ssl')
+
+
+def _current_panel():
+    toolbar = current_toolbar()
+    return toolbar and toolbar.get_panel(OutboundHTTPDebugPanel)
+
+
+class OutboundHTTPDebugPanel(DebugPanel):
+    """
+    Panel that displays the HTTP calls made while handling the request, with
+    the time spent resolving, connecting, waiting and transferring.
+
+    Calls are captured at the ``http.client`` level (urllib, urllib3 and
+    requests all go through it), only for instrumented requests.
+    """
+    name = 'OutboundHTTP'
+    has_content = True
+
+    def __init__(self, *args, **kwargs):
+        super(OutboundHTTPDebugPanel, self).__init__(*args, **kwargs)
+        self.calls = []
+        # time spent in DNS/TLS by the connection being opened
+        self.connecting = None
+
+    @classmethod
+    def init_app(cls, app, jinja_env, cache=None):
+        install_hooks()
+
+    def start_call(self, conn, method, url):
+        filename, lineno, function = get_call_site(CLIENT_MODULES)
+        scheme = 'https' if isinstance(conn, httplib.HTTPSConnection) else 'http'
+        call = {
+            'method': method,
+            'scheme': scheme,
+            'host': conn.host,
+            'port': conn.port,
+            'url': url,
+            'status': None,
+            'start': perf_counter(),
+            'end': None,
+            'new_connection': False,
+            'reusable': False,
+            'dns': 0.0,
+            'connect': 0.0,
+            'tls': 0.0,
+            'wait': 0.0,
+            'transfer': 0.0,
+            'bytes_sent': 0,
+            'bytes_received': 0,
+            'context': format_fname(filename),
+            'context_long': '%s:%d (%s)' % (filename, lineno, function),
+            'connection': id(conn),
+        }
+        self.calls.append(call)
+        return call
+
+    def connection_opened(self, call, timings):
+        """Account for a new connection opened for ``call``"""
+        call['new_connection'] = True
+        call.update(timings)
+        # A pooled connection could have been used if an earlier call to the
+        # same server had finished with its connection before this one
+        for other in self.calls:
+            if other is call or other['connection'] == call['connection']:
+                continue
+            if (other['scheme'], other['host'], other['port']) == \
+                    (call['scheme'], call['host'], call['port']) and \
+                    other['end'] is not None and other['end'] <= call['start']:
+                call['reusable'] = True
+                break
+
+    def process_response(self, request, response):
+        self.data = []
+        spans = current_spans()
+        for call in self.calls:
+            end = call['end'] or call['start']
+            if spans is not None:
+                spans.add('http', '%s %s://%s%s' % (
+                    call['method'], call['scheme'], call['host'], call['url']),
+                    call['start'], end)
+            row = dict(call)
+            row['total'] = end - call['start']
+            self.data.append(row)
+
+    def render_cache(self):
+        return {"title": self.title(), "nav_subtitile": self.nav_subtitle(), "content": self.content()}
+
+    def nav_title(self):
+        return _('HTTP Calls')
+
+    def nav_subtitle(self):
+        count = len(self.calls)
+        total = sum((call['end'] or call['start']) - call['start']
+                    for call in self.calls)
+        return '%d %s in %.2fms' % (count, 'call' if count == 1 else 'calls',
+                                    total * 1000)
+
+    def title(self):
+        return _('Outbound HTTP calls')
+
+    def url(self):
+        return ''
+
+    def content(self):
+        return self.render('panels/outbound_http.html', {
+            'calls': self.data,
+            'new_connections': sum(1 for c in self.data if c['new_connection']),
+            'reusable': sum(1 for c in self.data if c['reusable']),
+        })
+
+
+# Hooks
+
+_installed = False
+_install_lock = threading.Lock()
+
+
+def install_hooks():
+    """Instrument http.client (and urllib3's connections), once per process"""
+    global _installed
+    with _install_lock:
+        if _installed:
+            return
+        _installed = True
+
+        socket.getaddrinfo = _timed_getaddrinfo(socket.getaddrinfo)
+        if ssl is not None and hasattr(ssl, 'SSLContext'):
+            ssl.SSLContext.wrap_socket = _timed_wrap_socket(
+                ssl.SSLContext.wrap_socket)
+
+        connection_classes = [httplib.HTTPConnection, httplib.HTTPSConnection]
+        if urllib3_connection is not None:
+            connection_classes += [urllib3_connection.HTTPConnection,
+                                   urllib3_connection.HTTPSConnection]
+        for conn_class in connection_classes:
+            # only patch the classes which define their own connect
+            if 'connect' in vars(conn_class):
+                conn_class.connect = _timed_connect(conn_class.connect)
+
+        httplib.HTTPConnection.putrequest = _traced_putrequest(
+            httplib.HTTPConnection.putrequest)
+        httplib.HTTPConnection.send = _traced_send(httplib.HTTPConnection.send)
+        httplib.HTTPConnection.getresponse = _traced_getresponse(
+            httplib.HTTPConnection.getresponse)
+        httplib.HTTPResponse.read = _traced_read(httplib.HTTPResponse.read)
+
+
+def _timed_getaddrinfo(getaddrinfo):
+    def wrapper(*args, **kwargs):
+        panel = _current_panel()
+        if panel is None or panel.connecting is None:
+            return getaddrinfo(*args, **kwargs)
+        start = perf_counter()
+        try:
+            return getaddrinfo(*args, **kwargs)
+        finally:
+            panel.connecting['dns'] += perf_counter() - start
+    return wrapper
+
+
+def _timed_wrap_socket(wrap_socket):
+    def wrapper(*args, **kwargs):
+        panel = _current_panel()
+        if panel is None or panel.connecting is None:
+            return wrap_socket(*args, **kwargs)
+        start = perf_counter()
+        try:
+            return wrap_socket(*args, **kwargs)
+        finally:
+            panel.connecting['tls'] += perf_counter() - start
+    return wrapper
+
+
+def _timed_connect(connect):
+    def wrapper(self):
+        panel = _current_panel()
+        # connect of a subclass calling the one of its base class
+        if panel is None or panel.connecting is not None:
+            return connect(self)
+        panel.connecting = timings = {'dns': 0.0, 'tls': 0.0}
+        start = perf_counter()
+        try:
+            return connect(self)
+        finally:
+            panel.connecting = None
+            timings['connect'] = max(perf_counter() - start - timings['dns'] -
+                                     timings['tls'], 0.0)
+            call = getattr(self, '_fldt_call', None)
+            if call is not None and call['end'] is None:
+                panel.connection_opened(call, timings)
+            else:
+                # connected ahead of the request (e.g. urllib3 for https)
+                self._fldt_connected = timings
+    return wrapper
+
+
+def _traced_putrequest(putrequest):
+    def wrapper(self, method, url, *args, **kwargs):
+        panel = _current_panel()
+        if panel is not None:
+            self._fldt_call = call = panel.start_call(self, method, url)
+            timings = getattr(self, '_fldt_connected', None)
+            if timings is not None:
+                self._fldt_connected = None
+                panel.connection_opened(call, timings)
+        else:
+            self._fldt_call = None
+        return putrequest(self, method, url, *args, **kwargs)
+    return wrapper
+
+
+def _traced_send(send):
+    def wrapper(self, data):
+        call = getattr(self, '_fldt_call', None)
+        if call is not None and isinstance(data, bytes):
+            call['bytes_sent'] += len(data)
+        return send(self, data)
+    return wrapper
+
+
+def _traced_getresponse(getresponse):
+    def wrapper(self, *args, **kwargs):
+        call = getattr(self, '_fldt_call', None)
+        if call is None:
+            return getresponse(self, *args, **kwargs)
+        start = perf_counter()
+        response = getresponse(self, *args, **kwargs)
+        call['end'] = end = perf_counter()
+        call['wait'] = end - start
+        call['status'] = response.status
+        response._fldt_call = call
+        self._fldt_call = None
+        return response
+    return wrapper
+
+
+def _traced_read(read):
+    def wrapper(self, *args, **kwargs):
+        call = getattr(self, '_fldt_call', None)
+        if call is None:
+            return read(self, *args, **kwargs)
+        start = perf_counter()
+        data = read(self, *args, **kwargs)
+        call['end'] = end = perf_counter()
+        call['transfer'] += end - start
+        call['bytes_received'] += len(data)
+        return data
+    return wrapper
@@ -0,0 +1,169 @@
+import zlib
+
+from flask import current_app, session
+
+from ..debug_panel import DebugPanel
+from ..utils import REQUEST_ID_HEADER
+
+_ = lambda x: x
+
+# Content types worth compressing, the others (images, archives) already are
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/javascript',
+                      'application/xml', 'image/svg+xml')
+
+# Bodies larger than this are compressed in part, to estimate their size
+MAX_COMPRESSED = 1024 * 1024
+
+
+def format_size(size):
+    if size < 1024:
+        return '%d B' % size
+    if size < 1024 * 1024:
+        return '%.1f KB' % (size / 1024.0)
+    return '%.1f MB' % (size / 1024.0 / 1024.0)
+
+
+def gzip_size(body):
+    """Size of ``body`` gzipped at the level servers use, estimated from its
+    start when large"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    size = len(compressor.compress(body[:MAX_COMPRESSED]) + compressor.flush())
+    if len(body) > MAX_COMPRESSED:
+        size = int(size * float(len(body)) / MAX_COMPRESSED)
+    return size
+
+
+def session_cookie(app, session):
+    """The value of the session cookie Flask will set after the response
+    hooks ran (which include the toolbar's), None if it won't set one"""
+    interface = app.session_interface
+    if interface.is_null_session(session):
+        return None
+    should_set_cookie = getattr(interface, 'should_set_cookie', None)
+    if should_set_cookie is not None and not should_set_cookie(app, session):
+        return None
+    get_signing_serializer = getattr(interface, 'get_signing_serializer', None)
+    serializer = get_signing_serializer and get_signing_serializer(app)
+    if serializer is None or not session:
+        return None
+    return serializer.dumps(dict(session))
+
+
+class PayloadDebugPanel(DebugPanel):
+    """
+    Panel that displays the size of the response: its body, headers and
+    cookies, and of the session, flagging the large cookies, which the
+    client sends back with every request, and the large bodies sent
+    uncompressed.
+    """
+    name = 'Payload'
+    has_content = True
+
+    def __init__(self, *args, **kwargs):
+        DebugPanel.__init__(self, *args, **kwargs)
+        self.body = None
+        self.body_size = self.gzip_size = self.session_size = None
+        self.header_size = 0
+        self.content_encoding = None
+        self.mimetype = ''
+        self.set_cookies = []
+        self.request_cookies = []
+        self.warnings = []
+
+    def process_response(self, request, response):
+        config = current_app.config
+        max_cookie = config.get('DEBUG_TB_PAYLOAD_MAX_COOKIE', 1024)
+        max_body = config.get('DEBUG_TB_PAYLOAD_MAX_BODY', 20 * 1024)
+        warnings = self.warnings = []
+
+        # the toolbar's own header left out
+        headers = [(name, value) for name, value in response.headers
+                   if name.lower() != REQUEST_ID_HEADER.lower()]
+        self.header_size = (len('HTTP/1.1 %s\r\n\r\n' % response.status) +
+                            sum(len(name) + len(value) + 4
+                                for name, value in headers))
+
+        self.set_cookies = []
+        for name, value in headers:
+            if name.lower() == 'set-cookie':
+                cookie = value.split('=', 1)[0]
+                self.set_cookies.append((cookie, len(value)))
+                if len(value) > max_cookie:
+                    warnings.append('The %s cookie set is %s, it is sent back '
+                                    'with every request' % (
+                                        cookie, format_size(len(value))))
+
+        self.session_size = None
+        value = session_cookie(current_app, session._get_current_object())
+        if value is not None:
+            self.session_size = len(value)
+            if self.session_size > max_cookie:
+                warnings.append('The session cookie set is %s, it is sent '
+                                'back with every request' % format_size(
+                                    self.session_size))
+
+        # what the client sent, but the toolbar's own cookies
+        self.request_cookies = [
+            (name, len(name) + len(value) + 1)
+            for name, value in request.cookies.items()
+            if not name.startswith('fldt_')]
+        for name, size in self.request_cookies:
+            if size > max_cookie:
+                warnings.append('The %s cookie sent by the client is %s' % (
+                    name, format_size(size)))
+
+        self.content_encoding = response.headers.get('Content-Encoding')
+        self.mimetype = response.mimetype or ''
+        # the body as the view returned it, without the toolbar; streamed
+        # bodies are left alone, read by the client only
+        if response.is_sequence:
+            self.body = response.get_data()
+            self.body_size = len(self.body)
+        else:
+            self.body_size = response.content_length
+        if (self.body_size is not None and self.body_size > max_body and
+                not self.content_encoding and
+                self.mimetype.startswith(COMPRESSIBLE_TYPES)):
+            warnings.append('The body is %s and sent uncompressed' %
+                            format_size(self.body_size))
+
+    def finalize(self):
+        self.gzip_size = None
+        if self.body and not self.content_encoding:
+            self.gzip_size = gzip_size(self.body)
+        self.body = None
+        super(PayloadDebugPanel, self).finalize()
+
+    def render_cache(self):
+        return {"title": self.title(), "nav_subtitile": self.nav_subtitle(), "content": self.content()}
+
+    def nav_title(self):
+        return _('Payload')
+
+    def nav_subtitle(self):
+        size = self.header_size + (self.body_size or 0)
+        if self.warnings:
+            return '%s, %d %s' % (format_size(size), len(self.warnings),
+                                  'warning' if len(self.warnings) == 1
+                                  else 'warnings')
+        return format_size(size)
+
+    def title(self):
+        return _('Response payload')
+
+    def url(self):
+        return ''
+
+    def content(self):
+        return self.render('panels/payload.html', {
+            'body_size': self.body_size,
+            'gzip_size': self.gzip_size,
+            'header_size': self.header_size,
+            'content_encoding': self.content_encoding,
+            'mimetype': self.mimetype,
+            'set_cookies': self.set_cookies,
+            'session_size': self.session_size,
+            'request_cookies': self.request_cookies,
+            'warnings': self.warnings,
+            'format_size': format_size,
+        })
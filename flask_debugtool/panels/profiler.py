@@ -4,32 +4,292 @@ try:
 except ImportError:
     import profile
 import functools
+import heapq
 import os.path
 import pstats
+import sysconfig
+import time
 
-from flask import current_app
+from flask import current_app, g, abort, request, send_from_directory
+from .. import module
+from ..compat import iteritems, perf_counter
 from ..debug_panel import DebugPanel
-from ..utils import format_fname
+from ..profiles import ProfileWriter
+from ..utils import cache_key, format_fname
+from ..watchdog import StackSampler, Watch, get_watchdog
+
+# Cache keys of the raw profile of a request, and of the pinned one
+STATS_KEY = 'Profiler.stats'
+PINNED_KEY = cache_key('pinned', STATS_KEY)
+
+_STDLIB_PATHS = tuple(set(
+    os.path.join(os.path.realpath(sysconfig.get_paths()[name]), '')
+    for name in ('stdlib', 'platstdlib')))
+
+# memoized per file name, there are as many as modules
+_module_names = {}
+_library_names = {}
+
+
+def module_name(filename):
+    """The dotted name of the module of a profiled function"""
+    name = _module_names.get(filename)
+    if name is None:
+        if filename == '~':
+            name = 'builtins'
+        elif filename.startswith('<frozen '):
+            name = filename[len('<frozen '):-1]
+        elif filename.startswith('<'):
+            name = filename
+        else:
+            path = os.path.splitext(min(
+                [os.path.relpath(filename, entry) for entry in sys.path
+                 if filename.startswith(os.path.join(entry, ''))] +
+                [filename], key=len))[0]
+            parts = [part for part in path.split(os.sep) if part]
+            if parts[-1:] == ['__init__']:
+                parts.pop()
+            name = '.'.join(parts)
+        _module_names[filename] = name
+    return name
+
+
+def _in_modules(name, modules):
+    return any(name == module or name.startswith(module + '.')
+               for module in modules)
+
+
+def library_name(filename):
+    """
+    The bucket of the functions of a third-party or standard library
+    package (``site-packages: flask``, ``stdlib: json``), None for the
+    application's own code
+    """
+    try:
+        return _library_names[filename]
+    except KeyError:
+        pass
+    name = None
+    if filename == '~':
+        name = 'built-in'
+    elif filename.startswith('<frozen '):
+        name = 'stdlib: %s' % module_name(filename).split('.')[0]
+    elif not filename.startswith('<'):
+        parts = os.path.realpath(filename).split(os.sep)
+        for marker in ('site-packages', 'dist-packages'):
+            if marker in parts[:-1]:
+                package = parts[parts.index(marker) + 1]
+                name = '%s: %s' % (marker, os.path.splitext(package)[0])
+                break
+        else:
+            path = os.path.realpath(filename)
+            for stdlib in _STDLIB_PATHS:
+                if path.startswith(stdlib):
+                    package = path[len(stdlib):].split(os.sep)[0]
+                    name = 'stdlib: %s' % os.path.splitext(package)[0]
+                    break
+    _library_names[filename] = name
+    return name
+
+
+def collapse_libraries(entries):
+    """
+    Merge the ``pstats`` entries of each library (see ``library_name``) into
+    a single one. Its calls and cumulative time are those of the calls
+    entering the library from outside of it, so that calls within the
+    library aren't counted twice.
+    """
+    collapsed = {}
+    buckets = {}
+    for func, info in iteritems(entries):
+        library = library_name(func[0])
+        if library is None:
+            collapsed[func] = info
+            continue
+        key = ('~', 0, '<%s>' % library)
+        calls, tottime, cumtime = buckets.get(key, (0, 0.0, 0.0))
+        tottime += info[2]
+        callers = info[4]
+        if not callers:
+            # called from where the profiler was enabled
+            calls += info[1]
+            cumtime += info[3]
+        for caller, caller_info in iteritems(callers):
+            if library_name(caller[0]) == library:
+                continue
+            if isinstance(caller_info, tuple):
+                calls += caller_info[0]
+                cumtime += caller_info[3]
+            else:
+                # the profile module only counts the calls
+                calls += caller_info
+        buckets[key] = (calls, tottime, cumtime)
+    for key, (calls, tottime, cumtime) in iteritems(buckets):
+        collapsed[key] = (calls, calls, tottime, max(cumtime, tottime), {})
+    return collapsed
+
+
+def raw_stats(stats):
+    """
+    The timings of a profile by function, as ``[cc, nc, tt, ct]`` lists
+    keyed by ``pstats.func_std_string``, without the callers
+    """
+    return {
+        'total_time': stats.total_tt,
+        'functions': dict(
+            (pstats.func_std_string(func), list(info[:4]))
+            for func, info in iteritems(stats.stats)),
+    }
+
+
+def function_rows(selected):
+    """The table rows of ``(function, (cc, nc, tt, ct))`` pairs, times in
+    milliseconds"""
+    function_calls = []
+    for func, info in selected:
+        current = {}
+
+        # Number of calls
+        if info[0] != info[1]:
+            current['ncalls'] = '%d/%d' % (info[1], info[0])
+        else:
+            current['ncalls'] = info[1]
+
+        # Total time
+        current['tottime'] = info[2] * 1000
+
+        # Quotient of total time divided by number of calls
+        if info[1]:
+            current['percall'] = info[2] * 1000 / info[1]
+        else:
+            current['percall'] = 0
+
+        # Cumulative time
+        current['cumtime'] = info[3] * 1000
+
+        # Quotient of the cumulative time divded by the number of
+        # primitive calls.
+        if info[0]:
+            current['percall_cum'] = info[3] * 1000 / info[0]
+        else:
+            current['percall_cum'] = 0
+
+        # Filename
+        filename = pstats.func_std_string(func)
+        current['filename_long'] = filename
+        current['filename'] = format_fname(filename)
+        function_calls.append(current)
+    return function_calls
+
+
+def diff_stats(base, other, sort='self', max_rows=200):
+    """
+    Compare two ``raw_stats`` function by function, returns the changes of
+    calls, self and cumulative time of the ``max_rows`` functions which
+    changed the most (appearing and disappearing functions included), from
+    the largest regression to the largest improvement, and the number of
+    functions which changed, appeared and disappeared
+    """
+    base_functions = base['functions']
+    other_functions = other['functions']
+    index = 3 if sort == 'cumulative' else 2
+    rows = []
+    for name in set(base_functions) | set(other_functions):
+        before = base_functions.get(name)
+        after = other_functions.get(name)
+        old = before or [0, 0, 0.0, 0.0]
+        new = after or [0, 0, 0.0, 0.0]
+        if old == new:
+            continue
+        rows.append({
+            'function': name,
+            'status': 'new' if before is None else
+                      'gone' if after is None else '',
+            'calls': (old[1], new[1], new[1] - old[1]),
+            'tottime': (old[2] * 1000, new[2] * 1000,
+                        (new[2] - old[2]) * 1000),
+            'cumtime': (old[3] * 1000, new[3] * 1000,
+                        (new[3] - old[3]) * 1000),
+            'delta': new[index] - old[index],
+        })
+    counts = {
+        'changed': len(rows),
+        'new': sum(1 for row in rows if row['status'] == 'new'),
+        'gone': sum(1 for row in rows if row['status'] == 'gone'),
+    }
+    rows = heapq.nlargest(max_rows, rows, key=lambda row: abs(row['delta']))
+    rows.sort(key=lambda row: -row['delta'])
+    return rows, counts
+
+
+def reduce_stats(stats, sort='self', max_rows=200, collapse=False,
+                 include=(), exclude=()):
+    """
+    Select the ``max_rows`` entries of ``stats`` with the most ``self`` or
+    ``cumulative`` time, as ``(func, info)`` pairs, after keeping the
+    functions of the ``include`` modules (and their submodules) but not of
+    the ``exclude`` ones, and collapsing the libraries. Returns the pairs
+    and the number of entries they were selected from.
+    """
+    entries = stats.stats
+    if include or exclude:
+        entries = dict(
+            (func, info) for func, info in iteritems(entries)
+            if (not include or _in_modules(module_name(func[0]), include)) and
+            not _in_modules(module_name(func[0]), exclude))
+    if collapse:
+        entries = collapse_libraries(entries)
+    index = 3 if sort == 'cumulative' else 2
+    selected = heapq.nlargest(max_rows, iteritems(entries),
+                              key=lambda item: item[1][index])
+    return selected, len(entries)
 
 
 class ProfilerDebugPanel(DebugPanel):
     """
     Panel that displays the time a response took with cProfile output.
+
+    When it isn't activated and ``DEBUG_TB_PROFILER_TRIGGER`` is set to a
+    number of seconds, views running longer than that get their stack
+    sampled for the rest of their run, and the samples are shown instead.
+
+    With ``DEBUG_TB_PROFILER_DUMP_DIR`` set, the profiles are also written
+    there as ``.prof`` files, see ``ProfileWriter``.
     """
     name = 'Profiler'
 
     user_activate = True
 
+    # writes the .prof files, when enabled
+    writer = None
+
     def __init__(self, jinja_env, context={}, cache=None):
         DebugPanel.__init__(self, jinja_env, context=context, cache=cache)
+        self.profiler = None
+        self.sampler = None
+        self.sampled = False
+        self.dump_name = None
         if current_app.config.get('DEBUG_TB_PROFILER_ENABLED'):
             self.is_active = True
 
+    @classmethod
+    def init_app(cls, app, jinja_env, cache=None):
+        directory = app.config.get('DEBUG_TB_PROFILER_DUMP_DIR')
+        if directory and cls.writer is None:
+            cls.writer = ProfileWriter(
+                directory,
+                app.config.get('DEBUG_TB_PROFILER_DUMP_MAX_FILES', 100),
+                app.config.get('DEBUG_TB_PROFILER_DUMP_MAX_BYTES',
+                               100 * 1024 * 1024))
+
     def has_content(self):
         return bool(self.profiler)
 
     def process_request(self, request):
         if not self.is_active:
+            if current_app.config.get('DEBUG_TB_PROFILER_TRIGGER') is not None:
+                self.sampler = StackSampler(current_app.config.get(
+                    'DEBUG_TB_PROFILER_SAMPLE_INTERVAL', 0.005))
             return
 
         self.profiler = profile.Profile()
@@ -37,11 +297,51 @@ class ProfilerDebugPanel(DebugPanel):
 
     def process_view(self, request, view_func, view_kwargs):
         if self.is_active:
-            func = functools.partial(self.profiler.runcall, view_func)
+            func = functools.partial(self._runcall, view_func)
             functools.update_wrapper(func, view_func)
             return func
+        if self.sampler is not None:
+            func = functools.partial(self._runsampled, view_func)
+            functools.update_wrapper(func, view_func)
+            return func
+
+    def _runsampled(self, view_func, *args, **kwargs):
+        watch = Watch(self.sampler.add,
+                      current_app.config['DEBUG_TB_PROFILER_TRIGGER'],
+                      self.sampler.interval)
+        watchdog = get_watchdog()
+        watchdog.watch(watch)
+        try:
+            return view_func(*args, **kwargs)
+        finally:
+            watchdog.unwatch(watch)
+            self.view_time = perf_counter() - watch.start
+
+    def _runcall(self, view_func, *args, **kwargs):
+        # A profiler hooks the whole OS thread, so when requests are served
+        # by greenlets only one of the requests sharing a thread can be
+        # profiled at a time, the others run unprofiled.
+        if sys.getprofile() is not None:
+            self.profiler = None
+            return view_func(*args, **kwargs)
+        try:
+            self.profiler.enable()
+        except ValueError:
+            # another profiler is active (sys.monitoring, Python >= 3.12)
+            self.profiler = None
+            return view_func(*args, **kwargs)
+        try:
+            return view_func(*args, **kwargs)
+        finally:
+            self.profiler.disable()
 
     def process_response(self, request, response):
+        if self.sampler is not None and self.sampler.samples:
+            # the view ran past the trigger, keep what was sampled
+            self.is_active = self.sampled = True
+            self.total_time = self.view_time
+            return response
+
         if not self.is_active:
             return False
 
@@ -52,66 +352,80 @@ class ProfilerDebugPanel(DebugPanel):
             except TypeError:
                 self.is_active = False
                 return False
-            function_calls = []
-            for func in stats.sort_stats(1).fcn_list:
-                current = {}
-                info = stats.stats[func]
-
-                # Number of calls
-                if info[0] != info[1]:
-                    current['ncalls'] = '%d/%d' % (info[1], info[0])
-                else:
-                    current['ncalls'] = info[1]
-
-                # Total time
-                current['tottime'] = info[2] * 1000
-
-                # Quotient of total time divided by number of calls
-                if info[1]:
-                    current['percall'] = info[2] * 1000 / info[1]
-                else:
-                    current['percall'] = 0
-
-                # Cumulative time
-                current['cumtime'] = info[3] * 1000
-
-                # Quotient of the cumulative time divded by the number of
-                # primitive calls.
-                if info[0]:
-                    current['percall_cum'] = info[3] * 1000 / info[0]
-                else:
-                    current['percall_cum'] = 0
-
-                # Filename
-                filename = pstats.func_std_string(func)
-                current['filename_long'] = filename
-                current['filename'] = format_fname(filename)
-                function_calls.append(current)
-
             self.stats = stats
-            self.function_calls = function_calls
-            # destroy the profiler just in case
-            if self.cache:
-                info = []
-                for row in function_calls:
-                    info.append({
-                        "ncalls": row["ncalls"],
-                        "tottime": row["tottime"],
-                        "percall": row["percall"],
-                        "cumtime": row["cumtime"],
-                        "percall_cum": row["percall_cum"],
-                        "filename": row["filename"]}
-                    )
-                self.cache.set("DEBUGTOOLBAR:%s" % self.name, self.render_cache())
+            self.total_time = stats.total_tt
+            if self.writer is not None:
+                rule = request.url_rule
+                self.dump_name = self.writer.filename(
+                    rule.endpoint if rule is not None else None, time.time(),
+                    self.request_id)
+        else:
+            # the view ran unprofiled, see _runcall
+            self.is_active = False
         return response
 
+    def finalize(self):
+        if self.sampled:
+            self.function_calls = self._sampled_calls()
+        elif self.is_active:
+            self.function_calls = self._function_calls()
+            if self.cache:
+                # kept to be diffed against, see profiler_diff
+                self.cache.set(cache_key(self.request_id, STATS_KEY),
+                               raw_stats(self.stats))
+            if self.dump_name is not None and \
+                    not self.writer.write(self.stats, self.dump_name):
+                self.dump_name = None
+        super(ProfilerDebugPanel, self).finalize()
+
+    def _function_calls(self):
+        config = current_app.config
+        self.sort = config.get('DEBUG_TB_PROFILER_SORT', 'self')
+        selected, self.function_count = reduce_stats(
+            self.stats, self.sort,
+            config.get('DEBUG_TB_PROFILER_MAX_ROWS', 200),
+            config.get('DEBUG_TB_PROFILER_COLLAPSE_LIBRARIES', False),
+            config.get('DEBUG_TB_PROFILER_INCLUDE', ()),
+            config.get('DEBUG_TB_PROFILER_EXCLUDE', ()))
+        return function_rows(selected)
+
+    def _sampled_calls(self):
+        sampler = self.sampler
+        # samples are taken less often than asked when the view holds the
+        # GIL, weigh them by the time they actually cover
+        sampled_time = max(self.view_time -
+                           current_app.config['DEBUG_TB_PROFILER_TRIGGER'], 0)
+        per_sample = sampled_time * 1000 / sampler.samples
+        function_calls = []
+        # by self time, as the cProfile output
+        self.function_count = len(sampler.cumulative_counts)
+        keys = heapq.nlargest(
+            current_app.config.get('DEBUG_TB_PROFILER_MAX_ROWS', 200),
+            sampler.cumulative_counts, key=lambda func: (
+                sampler.self_counts.get(func, 0),
+                sampler.cumulative_counts[func]))
+        for func in keys:
+            filename = pstats.func_std_string(func)
+            function_calls.append({
+                'samples': sampler.cumulative_counts[func],
+                'tottime': sampler.self_counts.get(func, 0) * per_sample,
+                'cumtime': sampler.cumulative_counts[func] * per_sample,
+                'filename_long': filename,
+                'filename': format_fname(filename),
+            })
+        return function_calls
+
     def render_cache(self):
         return {"title": self.title(), "nav_subtitile": self.nav_subtitle(), "content": self.content()}
 
     def title(self):
         if not self.is_active:
             return "Profiler not active"
-        return 'View: %.2fms' % (float(self.stats.total_tt)*1000,)
+        if self.sampled:
+            return 'View: %.2fms (sampled past %.2fms)' % (
+                self.total_time * 1000,
+                current_app.config['DEBUG_TB_PROFILER_TRIGGER'] * 1000)
+        return 'View: %.2fms' % (float(self.total_time)*1000,)
 
     def nav_title(self):
         return 'Profiler'
@@ -119,7 +433,7 @@ class ProfilerDebugPanel(DebugPanel):
     def nav_subtitle(self):
         if not self.is_active:
             return "in-active"
-        return 'View: %.2fms' % (float(self.stats.total_tt)*1000,)
+        return 'View: %.2fms' % (float(self.total_time)*1000,)
 
     def url(self):
         return ''
@@ -128,8 +442,85 @@ class ProfilerDebugPanel(DebugPanel):
         if not self.is_active:
             return "The profiler is not activated, activate it to use it"
 
+        if self.sampled:
+            return self.render('panels/profiler_sampled.html', {
+                'function_calls': self.function_calls,
+                'samples': self.sampler.samples,
+                'interval': self.sampler.interval * 1000,
+                'function_count': self.function_count,
+            })
+
         context = {
+            'request_id': self.request_id,
+            'dump_name': self.dump_name,
             'stats': self.stats,
             'function_calls': self.function_calls,
+            'function_count': self.function_count,
+            'sort': self.sort,
+            'collapsed': current_app.config.get(
+                'DEBUG_TB_PROFILER_COLLAPSE_LIBRARIES', False),
         }
         return self.render('panels/profiler.html', context)
+
+
+# Panel views
+
+
+def _profile(request_id):
+    cache = g.debug_toolbar.cache
+    stats = cache.get(cache_key(request_id, STATS_KEY))
+    summary = cache.get(cache_key(request_id))
+    if stats is None or summary is None:
+        abort(404)
+    stats['request'] = {
+        'id': request_id,
+        'method': summary['method'],
+        'url': summary['url'],
+        'total_time': stats['total_time'] * 1000,
+    }
+    return stats
+
+
+@module.route('/profiler/pin/<request_id>', methods=['POST'])
+def profiler_pin(request_id):
+    # posted only, it replaces the profile the others are diffed against;
+    # a copy, which outlives the data of the request
+    stats = _profile(request_id)
+    g.debug_toolbar.cache.set(PINNED_KEY, stats, timeout=0)
+    return g.debug_toolbar.render('panels/profiler_diff.html', {
+        'base': stats['request'],
+        'other': None,
+    })
+
+
+@module.route('/profiler/download/<request_id>')
+def profiler_download(request_id):
+    """Send the .prof file of a request"""
+    writer = ProfilerDebugPanel.writer
+    name = writer and writer.find(request_id)
+    if name is None:
+        abort(404)
+    return send_from_directory(writer.directory, name, as_attachment=True)
+
+
+@module.route('/profiler/diff/<request_id>', methods=['GET', 'POST'])
+def profiler_diff(request_id):
+    """Diff the profile of a request against the pinned one, or against
+    the one of the ``base`` request"""
+    if request.args.get('base'):
+        base = _profile(request.args['base'])
+    else:
+        base = g.debug_toolbar.cache.get(PINNED_KEY)
+    other = _profile(request_id)
+    context = {
+        'base': base and base['request'],
+        'other': other['request'],
+        'sort': current_app.config.get('DEBUG_TB_PROFILER_SORT', 'self'),
+    }
+    if base is not None:
+        context['rows'], context['counts'] = diff_stats(
+            base, other, context['sort'],
+            current_app.config.get('DEBUG_TB_PROFILER_MAX_ROWS', 200))
+        for row in context['rows']:
+            row['filename'] = format_fname(row['function'])
+    return g.debug_toolbar.render('panels/profiler_diff.html', context)
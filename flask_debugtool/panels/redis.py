@@ -0,0 +1,223 @@
+from __future__ import absolute_import
+
+import threading
+try:
+    import redis
+    from redis.client import Pipeline
+except ImportError:
+    redis_available = False
+    redis = Pipeline = None
+else:
+    redis_available = True
+
+from ..compat import perf_counter
+from ..debug_panel import DebugPanel
+from ..spans import current_spans
+from ..toolbar import current_toolbar
+from ..utils import format_fname, get_call_site, decode_text
+
+_ = lambda x: x
+
+# Modules skipped when looking for the code which issued the command
+REDIS_MODULES = ('redis', 'fakeredis')
+
+# Consecutive commands worth sending in a single round trip
+PIPELINE_THRESHOLD = 3
+
+# Runs of single key commands which have a multi key variant
+MULTI_KEY_COMMANDS = {
+    'GET': 'MGET',
+    'SET': 'MSET',
+    'HGET': 'HMGET',
+    'SISMEMBER': 'SMISMEMBER',
+}
+
+
+def _current_panel():
+    toolbar = current_toolbar()
+    return toolbar and toolbar.get_panel(RedisDebugPanel)
+
+
+def reply_size(reply):
+    """Approximate size in bytes of a command's reply"""
+    if reply is None:
+        return 0
+    if isinstance(reply, bytes):
+        return len(reply)
+    if isinstance(reply, (list, tuple, set)):
+        return sum(reply_size(item) for item in reply)
+    if isinstance(reply, dict):
+        return sum(reply_size(k) + reply_size(v) for k, v in reply.items())
+    return len(str(reply))
+
+
+def format_args(args, limit=100):
+    formatted = ' '.join(decode_text(arg) if isinstance(arg, bytes)
+                         else str(arg) for arg in args)
+    if len(formatted) > limit:
+        formatted = formatted[:limit] + '...'
+    return formatted
+
+
+class RedisDebugPanel(DebugPanel):
+    """
+    Panel that displays the Redis commands issued by the request, flagging
+    sequences of commands which could have been pipelined.
+    """
+    name = 'Redis'
+
+    @property
+    def has_content(self):
+        if not redis_available:
+            return True  # will display an error message
+        return bool(self.commands)
+
+    def __init__(self, *args, **kwargs):
+        super(RedisDebugPanel, self).__init__(*args, **kwargs)
+        self.commands = []
+
+    @classmethod
+    def init_app(cls, app, jinja_env, cache=None):
+        if redis_available:
+            install_hooks()
+
+    def record(self, command, args, reply, duration, pipelined=()):
+        filename, lineno, function = get_call_site(REDIS_MODULES)
+        spans = current_spans()
+        if spans is not None:
+            end = perf_counter()
+            spans.add('redis', '%s %s' % (str(command).upper(),
+                                          format_args(args[:1])),
+                      end - duration, end)
+        self.commands.append({
+            'command': str(command).upper(),
+            'key': format_args(args[:1]),
+            'args': format_args(args),
+            'pipelined': [str(name).upper() for name in pipelined],
+            'duration': duration,
+            'size': reply_size(reply),
+            'hint': None,
+            'context': format_fname(filename),
+            'context_long': '%s:%d (%s)' % (filename, lineno, function),
+        })
+
+    def flag_commands(self):
+        """
+        Flag runs of single commands issued one after the other, each of
+        them costs a round trip where a pipeline or a multi key command
+        would have needed one
+        """
+        run = []
+        for command in self.commands + [None]:
+            if command is not None and command['command'] != 'PIPELINE':
+                run.append(command)
+                continue
+            self._flag_run(run)
+            run = []
+
+    def _flag_run(self, run):
+        start = 0
+        # same command on several keys first, e.g. GETs for an MGET
+        while start < len(run):
+            end = start
+            while end < len(run) and run[end]['command'] == run[start]['command']:
+                end += 1
+            multi = MULTI_KEY_COMMANDS.get(run[start]['command'])
+            if multi and end - start > 1:
+                for command in run[start:end]:
+                    command['hint'] = 'use %s' % multi
+            start = end
+        if len(run) >= PIPELINE_THRESHOLD:
+            for command in run:
+                if command['hint'] is None:
+                    command['hint'] = 'pipeline'
+
+    def process_response(self, request, response):
+        if not redis_available:
+            return
+        self.flag_commands()
+        self.data = self.commands
+
+    def render_cache(self):
+        return {"title": self.title(), "nav_subtitile": self.nav_subtitle(), "content": self.content()}
+
+    def nav_title(self):
+        return _('Redis')
+
+    def nav_subtitle(self):
+        if not redis_available:
+            return 'Unavailable'
+
+        count = len(self.commands)
+        total = sum(command['duration'] for command in self.commands)
+        return "%d %s in %.2fms" % (count, "command" if count == 1 else "commands",
+                                    total * 1000)
+
+    def title(self):
+        return _('Redis commands')
+
+    def url(self):
+        return ''
+
+    def content(self):
+        if not redis_available:
+            msg = ['Missing required libraries:', '<ul>']
+            msg.append('<li>redis</li>')
+            msg.append('</ul>')
+            return '\n'.join(msg)
+
+        return self.render('panels/redis.html', {
+            'commands': self.data,
+            'flagged': sum(1 for c in self.data if c['hint']),
+        })
+
+
+# Hooks
+
+_installed = False
+_install_lock = threading.Lock()
+
+
+def install_hooks():
+    """Instrument redis-py's clients, once per process"""
+    global _installed
+    with _install_lock:
+        if _installed:
+            return
+        _installed = True
+
+        redis.StrictRedis.execute_command = _traced_execute_command(
+            redis.StrictRedis.execute_command)
+        Pipeline.execute = _traced_execute(Pipeline.execute)
+
+
+def _traced_execute_command(execute_command):
+    def wrapper(self, *args, **options):
+        panel = _current_panel()
+        if panel is None:
+            return execute_command(self, *args, **options)
+        start = perf_counter()
+        reply = None
+        try:
+            reply = execute_command(self, *args, **options)
+            return reply
+        finally:
+            panel.record(args[0], args[1:], reply, perf_counter() - start)
+    return wrapper
+
+
+def _traced_execute(execute):
+    def wrapper(self, *args, **kwargs):
+        panel = _current_panel()
+        if panel is None:
+            return execute(self, *args, **kwargs)
+        pipelined = [command[0][0] for command in self.command_stack]
+        start = perf_counter()
+        reply = None
+        try:
+            reply = execute(self, *args, **kwargs)
+            return reply
+        finally:
+            panel.record('PIPELINE', (), reply, perf_counter() - start,
+                         pipelined)
+    return wrapper
@@ -1,6 +1,13 @@
-from flask import session
+from flask import current_app, g, abort, request, session
 
+from .. import module
 from ..debug_panel import DebugPanel
+from ..replay import Replay, capture
+from ..utils import cache_key
+from .profiler import function_rows, reduce_stats
+
+# Cache key of what is needed to replay a request
+REPLAY_NAME = 'RequestVars.replay'
 
 _ = lambda x: x
 
@@ -43,12 +50,52 @@ class RequestVarsDebugPanel(DebugPanel):
             'view_args': self.view_args,
             'view_kwargs': self.view_kwargs or {},
             'session': self.session.items(),
+            'request_id': self.request_id,
         })
+        self.replay = capture(self.request)
+
+    def finalize(self):
+        super(RequestVarsDebugPanel, self).finalize()
         if self.cache:
-            self.cache.set("DEBUGTOOLBAR:%s" % self.name, self.render_cache())
+            self.cache.set(cache_key(self.request_id, REPLAY_NAME), self.replay)
 
     def render_cache(self):
         return {"title": self.title(), "nav_subtitile": self.nav_subtitle(), "content": self.content()}
 
     def content(self):
         return self.render('panels/request_vars.html', self.data)
+
+
+@module.route('/replay/<request_id>', methods=['POST'])
+def replay(request_id):
+    """Issue a request again ``count`` times from ``concurrency`` threads,
+    profiling each run with ``profile=1``, the form posted since the
+    request's side effects are repeated"""
+    captured = g.debug_toolbar.cache.get(cache_key(request_id, REPLAY_NAME))
+    if captured is None:
+        abort(404)
+    config = current_app.config
+    count = min(max(request.form.get('count', 20, type=int), 1),
+                config.get('DEBUG_TB_REPLAY_MAX_COUNT', 1000))
+    concurrency = min(max(request.form.get('concurrency', 1, type=int), 1),
+                      config.get('DEBUG_TB_REPLAY_MAX_CONCURRENCY', 16))
+    batch = Replay(current_app._get_current_object(), captured,
+                   profile=request.form.get('profile', type=int) == 1)
+    batch.run(count, concurrency)
+
+    context = batch.summary()
+    context.update({
+        'request': captured,
+        'concurrency': concurrency,
+        'profiled': batch.profile,
+    })
+    if batch.stats is not None:
+        context['sort'] = config.get('DEBUG_TB_PROFILER_SORT', 'self')
+        selected, context['function_count'] = reduce_stats(
+            batch.stats, context['sort'],
+            config.get('DEBUG_TB_PROFILER_MAX_ROWS', 200),
+            config.get('DEBUG_TB_PROFILER_COLLAPSE_LIBRARIES', False),
+            config.get('DEBUG_TB_PROFILER_INCLUDE', ()),
+            config.get('DEBUG_TB_PROFILER_EXCLUDE', ()))
+        context['function_calls'] = function_rows(selected)
+    return g.debug_toolbar.render('panels/replay.html', context)
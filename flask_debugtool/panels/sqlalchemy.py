@@ -1,15 +1,8 @@
-try:
-    from flask.ext.sqlalchemy import get_debug_queries, SQLAlchemy
-except ImportError:
-    sqlalchemy_available = False
-    get_debug_queries = SQLAlchemy = None
-else:
-    sqlalchemy_available = True
-
 from flask import request, current_app, abort, json_available, g
 from .. import module
 from ..debug_panel import DebugPanel
-from ..utils import format_fname, format_sql
+from ..spans import current_spans
+from ..utils import format_fname, format_sql, get_debug_queries
 import itsdangerous
 
 
@@ -54,28 +47,54 @@ class SQLAlchemyDebugPanel(DebugPanel):
     Panel that displays the time a response took in milliseconds.
     """
     name = 'SQLAlchemy'
+
+    def __init__(self, *args, **kwargs):
+        super(SQLAlchemyDebugPanel, self).__init__(*args, **kwargs)
+        # the queries of the request, kept for finalize which runs without
+        # the application context they were recorded in
+        self.queries = None
+        self.data = []
+
+    def _queries(self):
+        if self.queries is None:
+            return get_debug_queries()
+        return self.queries
+
+    def _available(self):
+        # Flask-SQLAlchemy is only there once the application imported it
+        return json_available and self._queries() is not None
+
     @property
     def has_content(self):
-        if not json_available or not sqlalchemy_available:
+        if not self._available():
             return True  # will display an error message
-        return bool(get_debug_queries())
+        return bool(self._queries())
 
     def process_request(self, request):
         pass
 
     def process_response(self, request, response):
         queries = get_debug_queries()
-        self.data = []
-        for query in queries:
-            self.data.append({
-                'duration': query.duration,
-                'sql': format_sql(query.statement, query.parameters),
-                'signed_query': dump_query(query.statement, query.parameters),
-                'context_long': query.context,
-                'context': format_fname(query.context)
-            })
-        if self.cache:
-            self.cache.set("DEBUGTOOLBAR:%s" % self.name, self.render_cache())
+        if queries is None:
+            return
+        self.queries = list(queries)
+        spans = current_spans()
+        if spans is not None:
+            for query in self.queries:
+                # Flask-SQLAlchemy times the queries with time.time() or
+                # perf_counter depending on its version
+                spans.add_any('sql', query.statement[:100], query.start_time,
+                              query.end_time)
+
+    def finalize(self):
+        self.data = [{
+            'duration': query.duration,
+            'sql': format_sql(query.statement, query.parameters),
+            'signed_query': dump_query(query.statement, query.parameters),
+            'context_long': query.context,
+            'context': format_fname(query.context)
+        } for query in self.queries or ()]
+        super(SQLAlchemyDebugPanel, self).finalize()
 
     def render_cache(self):
         return {"title": self.title(), "nav_subtitile": self.nav_subtitle(), "content": self.content()}
@@ -84,12 +103,11 @@ class SQLAlchemyDebugPanel(DebugPanel):
         return _('SQLAlchemy')
 
     def nav_subtitle(self):
-        if not json_available or not sqlalchemy_available:
+        if not self._available():
             return 'Unavailable'
 
-        if get_debug_queries:
-            count = len(get_debug_queries())
-            return "%d %s" % (count, "query" if count == 1 else "queries")
+        count = len(self._queries())
+        return "%d %s" % (count, "query" if count == 1 else "queries")
 
     def title(self):
         return _('SQLAlchemy queries')
@@ -98,11 +116,11 @@ class SQLAlchemyDebugPanel(DebugPanel):
         return ''
 
     def content(self):
-        if not json_available or not sqlalchemy_available:
+        if not self._available():
             msg = ['Missing required libraries:', '<ul>']
             if not json_available:
                 msg.append('<li>simplejson</li>')
-            if not sqlalchemy_available:
+            if self._queries() is None:
                 msg.append('<li>Flask-SQLAlchemy</li>')
             msg.append('</ul>')
             return '\n'.join(msg)
@@ -116,6 +134,8 @@ class SQLAlchemyDebugPanel(DebugPanel):
 @module.route('/sqlalchemy/sql_explain', methods=['GET', 'POST'],
               defaults=dict(explain=True))
 def sql_select(explain=False):
+    from flask_sqlalchemy import SQLAlchemy
+
     statement, params = load_query(request.args['query'])
     engine = SQLAlchemy().get_engine(current_app)
 
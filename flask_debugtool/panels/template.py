@@ -4,13 +4,20 @@ import sys
 import traceback
 import uuid
 from jinja2.exceptions import TemplateSyntaxError
+from werkzeug.local import LocalProxy
 
 from flask import (
     template_rendered, request, g, render_template_string,
     Response, current_app, abort, url_for
 )
+try:
+    from flask import before_render_template
+except ImportError:
+    before_render_template = None  # Flask < 0.11
 from .. import module
+from ..compat import perf_counter
 from ..debug_panel import DebugPanel
+from ..toolbar import current_toolbar
 
 _ = lambda x: x
 
@@ -27,16 +34,26 @@ class TemplateDebugPanel(DebugPanel):
 
     @classmethod
     def get_cache_for_key(self, key):
-        for cache_key, value in self.template_cache:
+        # iterate over a copy, other requests may append meanwhile
+        for cache_key, value in list(self.template_cache):
             if key == cache_key:
                 return value
         raise KeyError(key)
 
+    @classmethod
+    def init_app(cls, app, jinja_env, cache=None):
+        # A single receiver for all requests, which hands the template over
+        # to the panel of the request it was rendered for
+        template_rendered.connect(_template_rendered)
+        if before_render_template is not None:
+            before_render_template.connect(_before_render_template)
+
     def __init__(self, *args, **kwargs):
         super(self.__class__, self).__init__(*args, **kwargs)
         self.key = str(uuid.uuid4())
         self.templates = []
-        template_rendered.connect(self._store_template_info)
+        # start times of the templates being rendered, they may nest
+        self.render_starts = []
 
     def _store_template_info(self, sender, **kwargs):
         # only record in the cache if the editor is enabled and there is
@@ -44,12 +61,24 @@ class TemplateDebugPanel(DebugPanel):
         if not self.templates and is_editor_enabled():
             self.template_cache.append((self.key, self.templates))
         self.templates.append(kwargs)
+        end = perf_counter()
+        start = self.render_starts.pop() if self.render_starts else end
+        toolbar = current_toolbar()
+        toolbar.spans.add('template', kwargs['template'].name or '(string)',
+                          start, end)
 
     def process_request(self, request):
         pass
 
     def process_response(self, request, response):
-        pass
+        # The content may be rendered once the request is over, when the
+        # context's request, session and g proxies are no longer bound
+        for template in self.templates:
+            template['context'] = dict(
+                (k, _resolve(v)) for k, v in template['context'].items())
+
+    def render_cache(self):
+        return {"title": self.title(), "nav_subtitile": self.nav_subtitle(), "content": self.content()}
 
     def nav_title(self):
         return _('Templates')
@@ -71,6 +100,29 @@ class TemplateDebugPanel(DebugPanel):
         })
 
 
+def _resolve(value):
+    if isinstance(value, LocalProxy):
+        try:
+            return value._get_current_object()
+        except RuntimeError:
+            pass
+    return value
+
+
+def _before_render_template(sender, **kwargs):
+    toolbar = current_toolbar()
+    panel = toolbar and toolbar.get_panel(TemplateDebugPanel)
+    if panel is not None:
+        panel.render_starts.append(perf_counter())
+
+
+def _template_rendered(sender, **kwargs):
+    toolbar = current_toolbar()
+    panel = toolbar and toolbar.get_panel(TemplateDebugPanel)
+    if panel is not None:
+        panel._store_template_info(sender, **kwargs)
+
+
 def is_editor_enabled():
     return current_app.config.get('DEBUG_TB_TEMPLATE_EDITOR_ENABLED')
 
@@ -0,0 +1,145 @@
+import functools
+import inspect
+import threading
+
+from flask import current_app, g
+from werkzeug.utils import import_string
+
+from ..compat import perf_counter
+from ..debug_panel import DebugPanel
+
+_ = lambda x: x
+
+# The counters of the instrumented request being handled by the thread (or
+# greenlet, when monkey-patched). Much cheaper to look up than the request
+# context, which matters for functions called thousands of times.
+_local = threading.local()
+
+
+class TimedFunctionsDebugPanel(DebugPanel):
+    """
+    Panel that displays the calls to the functions listed in
+    ``DEBUG_TB_TIMED_FUNCTIONS`` as dotted paths (``package.module.function``
+    or ``package.module.Class.method``), each wrapped with a timer counting
+    its calls, total, min and max time in instrumented requests.
+
+    The functions are replaced where they are defined, code which imported
+    them before ``init_app`` (``from module import function``) keeps calling
+    the original.
+    """
+    name = 'TimedFunctions'
+    has_content = True
+
+    def __init__(self, *args, **kwargs):
+        super(TimedFunctionsDebugPanel, self).__init__(*args, **kwargs)
+        # {path: [calls, total, min, max]}
+        self.timers = {}
+        self.rows = []
+
+    @classmethod
+    def init_app(cls, app, jinja_env, cache=None):
+        for path in app.config.get('DEBUG_TB_TIMED_FUNCTIONS', ()):
+            try:
+                wrap_function(path)
+            except (ImportError, AttributeError) as e:
+                app.logger.warning('Not timing %s: %s', path, e)
+        app.teardown_request(_clear_timers)
+
+    def process_request(self, request):
+        _local.timers = self.timers
+
+    def process_response(self, request, response):
+        self.rows = [{
+            'path': path,
+            'calls': calls,
+            'total': total,
+            'mean': total / calls,
+            'min': low,
+            'max': high,
+        } for path, (calls, total, low, high) in sorted(self.timers.items())]
+
+        if current_app.config['DEBUG_TB_STATS_ENABLED']:
+            rule = request.url_rule
+            endpoint = rule.endpoint if rule is not None else '<unmatched>'
+            for row in self.rows:
+                g.debug_toolbar.stats.add(endpoint, response.status_code,
+                                          row['total'],
+                                          timing='fn %s' % row['path'])
+
+    def render_cache(self):
+        return {"title": self.title(), "nav_subtitile": self.nav_subtitle(), "content": self.content()}
+
+    def nav_title(self):
+        return _('Timed functions')
+
+    def nav_subtitle(self):
+        calls = sum(row['calls'] for row in self.rows)
+        total = sum(row['total'] for row in self.rows)
+        return '%d %s in %.2fms' % (calls, 'call' if calls == 1 else 'calls',
+                                    total * 1000)
+
+    def title(self):
+        return _('Timed functions')
+
+    def url(self):
+        return ''
+
+    def content(self):
+        return self.render('panels/timed_functions.html', {
+            'rows': self.rows,
+            'paths': current_app.config.get('DEBUG_TB_TIMED_FUNCTIONS', ()),
+        })
+
+
+def wrap_function(path):
+    """Replace the function at ``path`` with a timed one, once"""
+    owner_path, name = path.rsplit('.', 1)
+    owner = import_string(owner_path)
+    if inspect.isclass(owner):
+        # wrap what the class defines, keeping static and class methods
+        for klass in inspect.getmro(owner):
+            if name in vars(klass):
+                attribute = vars(klass)[name]
+                break
+        else:
+            raise AttributeError('%s has no attribute %s' % (owner_path, name))
+        if isinstance(attribute, (staticmethod, classmethod)):
+            func = attribute.__func__
+            if getattr(func, '_fldt_timed', False):
+                return
+            setattr(owner, name, type(attribute)(_timed(path, func)))
+            return
+    else:
+        attribute = getattr(owner, name)
+    if getattr(attribute, '_fldt_timed', False):
+        return
+    setattr(owner, name, _timed(path, attribute))
+
+
+def _clear_timers(exc):
+    _local.timers = None
+
+
+def _timed(path, func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        timers = getattr(_local, 'timers', None)
+        if timers is None:
+            return func(*args, **kwargs)
+        start = perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            duration = perf_counter() - start
+            timer = timers.get(path)
+            if timer is None:
+                timers[path] = [1, duration, duration, duration]
+            else:
+                timer[0] += 1
+                timer[1] += duration
+                if duration < timer[2]:
+                    timer[2] = duration
+                if duration > timer[3]:
+                    timer[3] = duration
+    wrapper._fldt_timed = True
+    return wrapper
@@ -0,0 +1,114 @@
+import json
+
+from ..compat import perf_counter
+from ..debug_panel import DebugPanel
+from ..toolbar import current_toolbar
+
+_ = lambda x: x
+
+# Rows above which spans are merged further, the browser only draws the
+# rows scrolled into view but the data still has to be sent
+MAX_ROWS = 1000
+
+
+def merge_runs(rows, same):
+    """Merge consecutive rows for which ``same(row, previous row)`` holds"""
+    merged = []
+    for row in rows:
+        last = merged[-1] if merged else None
+        if last is not None and same(row, last):
+            last['count'] += row['count']
+            last['duration'] += row['duration']
+            last['end'] = max(last['end'], row['end'])
+            if last['name'] != row['name']:
+                last['name'] = '%s spans' % last['category']
+        else:
+            merged.append(dict(row))
+    return merged
+
+
+def aggregate(spans, max_rows=MAX_ROWS):
+    """
+    Rows of the waterfall, in start order. Runs of spans with the same
+    category and name (e.g. the same query made in a loop) make a single
+    row, and when there are still too many rows the runs of the same
+    category are merged as well.
+    """
+    rows = [{
+        'category': category,
+        'name': name,
+        'start': start,
+        'end': end,
+        'duration': end - start,
+        'count': 1,
+    } for category, name, start, end in sorted(spans, key=lambda s: s[2])]
+
+    rows = merge_runs(rows, lambda row, last: (
+        row['category'], row['name']) == (last['category'], last['name']))
+    if len(rows) > max_rows:
+        rows = merge_runs(rows, lambda row, last: (
+            row['category'] == last['category'] != 'flask'))
+    return rows[:max_rows], max(len(rows) - max_rows, 0)
+
+
+class TimelineDebugPanel(DebugPanel):
+    """
+    Panel that displays the spans recorded by the other panels (SQL queries,
+    templates, log records...) and the phases of the request as a waterfall.
+
+    It shows the spans recorded when it processes the response, so it comes
+    after the other panels in ``DEBUG_TB_PANELS``.
+    """
+    name = 'Timeline'
+    has_content = True
+
+    def __init__(self, *args, **kwargs):
+        super(TimelineDebugPanel, self).__init__(*args, **kwargs)
+        self.spans = []
+        self.rows = []
+        self.truncated = 0
+        self.total = 0.0
+        self.span_count = 0
+
+    def process_response(self, request, response):
+        toolbar = current_toolbar()
+        spans = toolbar.spans
+        if toolbar.response_start is not None:
+            # the toolbar's own work so far: the panels processing the response
+            spans.add('toolbar', 'process_response', toolbar.response_start,
+                      perf_counter())
+
+        self.spans = list(spans.spans)
+        self.span_count = len(self.spans)
+
+    def finalize(self):
+        self.rows, self.truncated = aggregate(self.spans)
+        self.total = max([row['end'] for row in self.rows] or [0.0])
+        super(TimelineDebugPanel, self).finalize()
+
+    def render_cache(self):
+        return {"title": self.title(), "nav_subtitile": self.nav_subtitle(), "content": self.content()}
+
+    def nav_title(self):
+        return _('Timeline')
+
+    def nav_subtitle(self):
+        return '%d spans' % self.span_count
+
+    def title(self):
+        return _('Request timeline')
+
+    def url(self):
+        return ''
+
+    def content(self):
+        # compact rows for the script drawing the waterfall, times in ms
+        rows = [[row['category'], row['name'], row['count'],
+                 round(row['start'] * 1000, 3), round(row['end'] * 1000, 3),
+                 round(row['duration'] * 1000, 3)] for row in self.rows]
+        return self.render('panels/timeline.html', {
+            'rows': json.dumps(rows),
+            'span_count': self.span_count,
+            'truncated': self.truncated,
+            'total': self.total * 1000,
+        })
@@ -1,9 +1,13 @@
 try:
     import resource
+    # Only count the usage of the thread serving the request when the
+    # platform allows it, the process' usage includes the other requests
+    RUSAGE_WHO = getattr(resource, 'RUSAGE_THREAD', resource.RUSAGE_SELF)
 except ImportError:
     pass  # Will fail on Win32 systems
 import time
 from ..debug_panel import DebugPanel
+from ..toolbar import current_toolbar
 
 _ = lambda x: x
 
@@ -14,6 +18,7 @@ class TimerDebugPanel(DebugPanel):
     """
     name = 'Timer'
     rows = tuple()
+    stack_dumps = ()
     try:  # if resource module not available, don't show content panel
         resource
     except NameError:
@@ -26,12 +31,12 @@ class TimerDebugPanel(DebugPanel):
     def process_request(self, request):
         self._start_time = time.time()
         if self.has_resource:
-            self._start_rusage = resource.getrusage(resource.RUSAGE_SELF)
+            self._start_rusage = resource.getrusage(RUSAGE_WHO)
 
     def process_response(self, request, response):
         self.total_time = (time.time() - self._start_time) * 1000
         if self.has_resource:
-            self._end_rusage = resource.getrusage(resource.RUSAGE_SELF)
+            self._end_rusage = resource.getrusage(RUSAGE_WHO)
 
         utime = 1000 * self._elapsed_ru('ru_utime')
         stime = 1000 * self._elapsed_ru('ru_stime')
@@ -62,8 +67,22 @@ class TimerDebugPanel(DebugPanel):
 #            ('Disk operations', '%d in, %d out, %d swapout' % (blkin, blkout, swap)),
         )
         self.rows = rows
-        if self.cache:
-            self.cache.set("DEBUGTOOLBAR:%s" % self.name, self.render_cache())
+
+        # dumped by the watchdog if the request ran past DEBUG_TB_HUNG_THRESHOLD
+        toolbar = current_toolbar()
+        if toolbar is not None:
+            self.stack_dumps = list(toolbar.stack_dumps)
+
+    @classmethod
+    def stored_content(cls, jinja_env, info, summary):
+        # the timings of the WSGI middleware, known once the server closed
+        # the response, so only to the toolbar rendered afterwards
+        content = info.get('content', '')
+        timings = summary.get('wsgi')
+        if timings is None:
+            return content
+        template = jinja_env.get_template('panels/timer_wsgi.html')
+        return content + template.render(timings=timings)
 
     def render_cache(self):
         return {"title": self.title(), "nav_subtitile": self.nav_subtitle(), "content": self.content()}
@@ -93,6 +112,7 @@ class TimerDebugPanel(DebugPanel):
         context = self.context.copy()
         context.update({
             'rows': self.rows,
+            'stack_dumps': self.stack_dumps,
         })
 
         return self.render('panels/timer.html', context)
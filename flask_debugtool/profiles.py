@@ -0,0 +1,107 @@
+"""Raw profiles of requests, written as .prof files for offline analysis"""
+import logging
+import os
+import re
+import threading
+import time
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+logger = logging.getLogger('flask_debugtool.profiles')
+
+
+class ProfileWriter(object):
+    """
+    Dumps the profiles (``pstats.Stats``) of requests to a directory as
+    ``<endpoint>-<time>-<request id>.prof`` files, which ``pstats``,
+    snakeviz or gprof2dot read. The files are written by a background
+    thread, which then removes the oldest ones past ``max_files`` files or
+    ``max_bytes`` in total. Past ``max_queued`` profiles waiting to be
+    written, new ones are dropped rather than piling up in memory.
+    """
+    suffix = '.prof'
+
+    def __init__(self, directory, max_files=100, max_bytes=100 * 1024 * 1024,
+                 max_queued=20):
+        self.directory = directory
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self.queue = queue.Queue(max_queued)
+        self.lock = threading.Lock()
+        self.thread = None
+        self.pid = None
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def filename(self, endpoint, timestamp, request_id):
+        endpoint = re.sub(r'[^A-Za-z0-9_.-]', '_', endpoint or 'unmatched')
+        return '%s-%s-%03d-%s%s' % (
+            endpoint, time.strftime('%Y%m%d-%H%M%S', time.localtime(timestamp)),
+            timestamp % 1 * 1000, request_id, self.suffix)
+
+    def write(self, stats, filename):
+        """Queue ``stats`` to be written, returns False if it was dropped"""
+        self._ensure_thread()
+        try:
+            self.queue.put_nowait((stats, filename))
+        except queue.Full:
+            return False
+        return True
+
+    def find(self, request_id):
+        """The name of the file of a request, None if it isn't there (yet)"""
+        ending = '-%s%s' % (request_id, self.suffix)
+        for name in os.listdir(self.directory):
+            if name.endswith(ending):
+                return name
+        return None
+
+    def _ensure_thread(self):
+        # The thread doesn't survive a fork, e.g. into pre-forked workers
+        with self.lock:
+            if self.pid == os.getpid() and self.thread.is_alive():
+                return
+            self.pid = os.getpid()
+            self.thread = threading.Thread(target=self._run,
+                                           name='flask_debugtool.profiles')
+            self.thread.daemon = True
+            self.thread.start()
+
+    def _run(self):
+        while True:
+            stats, filename = self.queue.get()
+            path = os.path.join(self.directory, filename)
+            try:
+                # renamed once complete, so that it is never read half written
+                stats.dump_stats(path + '.tmp')
+                os.rename(path + '.tmp', path)
+                self.rotate()
+            except (IOError, OSError) as e:
+                logger.warning('Cannot write the profile %s: %s', path, e)
+                try:
+                    os.remove(path + '.tmp')
+                except OSError:
+                    pass  # never created
+            del stats
+
+    def rotate(self):
+        files = []
+        for name in os.listdir(self.directory):
+            if name.endswith(self.suffix):
+                try:
+                    stat = os.stat(os.path.join(self.directory, name))
+                except OSError:
+                    continue  # removed by another process
+                files.append((stat.st_mtime, name, stat.st_size))
+        files.sort()
+        total = sum(size for _, _, size in files)
+        while files and (len(files) > self.max_files or total > self.max_bytes):
+            _, name, size = files.pop(0)
+            total -= size
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
@@ -0,0 +1,212 @@
+"""Replays of a captured request, to measure it under load"""
+import threading
+
+try:
+    import cProfile as profile
+except ImportError:
+    import profile
+import pstats
+
+from werkzeug.datastructures import MultiDict
+
+from .compat import iteritems, perf_counter
+from .stats import percentile
+from .utils import get_debug_queries
+
+# Key of the WSGI environ marking the requests replayed by the toolbar,
+# which are neither instrumented nor counted in the stats
+REPLAY_KEY = 'flask_debugtool.replay'
+
+# Bodies larger than this aren't kept
+MAX_BODY = 64 * 1024
+
+# Headers set by the test client itself
+_SKIPPED_HEADERS = ('host', 'content-length', 'content-type', 'cookie')
+
+
+def capture(request):
+    """What is needed to issue ``request`` again, once it was handled"""
+    cookies = [part.strip() for part in
+               request.headers.get('Cookie', '').split(';')]
+    captured = {
+        'method': request.method,
+        'path': request.path,
+        'query_string': request.environ.get('QUERY_STRING', ''),
+        'headers': [(name, value) for name, value in request.headers
+                    if name.lower() not in _SKIPPED_HEADERS],
+        # but the toolbar's own cookies
+        'cookie': '; '.join(part for part in cookies
+                            if part and not part.startswith('fldt_')),
+        'content_type': request.headers.get('Content-Type'),
+        'form': None,
+        'data': None,
+        'files': len(request.files),
+        'truncated': False,
+    }
+    if request.form or request.files:
+        captured['form'] = list(request.form.items(multi=True))
+    elif request.content_length:
+        if request.content_length > MAX_BODY:
+            captured['truncated'] = True
+        else:
+            captured['data'] = request.get_data(cache=True)
+    return captured
+
+
+class Replay(object):
+    """
+    Issues a captured request through the test client of ``app`` from a
+    pool of threads, each with its own client, timing each response and
+    gathering the SQL queries it ran and, with ``profile``, its profile.
+    """
+
+    def __init__(self, app, captured, profile=False):
+        self.app = app
+        self.captured = captured
+        self.profile = profile
+        self.lock = threading.Lock()
+        self.remaining = 0
+        self.durations = []
+        self.statuses = {}
+        self.errors = []
+        self.query_counts = []
+        # count, total and max duration of the queries, by statement
+        self.queries = {}
+        self.stats = None
+        self.unprofiled = 0
+        self.elapsed = 0.0
+
+    def run(self, count, concurrency=1):
+        self.remaining = count
+        threads = [threading.Thread(target=self._work,
+                                    name='flask_debugtool.replay')
+                   for _ in range(min(concurrency, count))]
+        start = perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.elapsed = perf_counter() - start
+        self.durations.sort()
+        return self
+
+    def _work(self):
+        # without a cookie jar, each run sends the captured cookies only
+        client = self.app.test_client(use_cookies=False)
+        while True:
+            with self.lock:
+                if not self.remaining:
+                    return
+                self.remaining -= 1
+            self._issue(client)
+
+    def _issue(self, client):
+        captured = self.captured
+        headers = list(captured['headers'])
+        if captured['cookie']:
+            headers.append(('Cookie', captured['cookie']))
+        kwargs = {}
+        if captured['form'] is not None:
+            kwargs['data'] = MultiDict(captured['form'])
+        elif captured['data'] is not None:
+            kwargs['data'] = captured['data']
+
+        profiler = None
+        if self.profile:
+            profiler = profile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                # another profiler is active, e.g. of a concurrent replay
+                profiler = None
+        # the request context is kept until the next request, to read the
+        # queries of this one
+        with client:
+            start = perf_counter()
+            try:
+                response = client.open(
+                    captured['path'], method=captured['method'],
+                    query_string=captured['query_string'], headers=headers,
+                    content_type=captured['content_type'],
+                    environ_overrides={REPLAY_KEY: True}, **kwargs)
+                response.close()
+            except Exception as e:
+                error = '%s: %s' % (type(e).__name__, e)
+                response = None
+            duration = perf_counter() - start
+            if profiler is not None:
+                profiler.disable()
+            queries = get_debug_queries() or ()
+
+        with self.lock:
+            if response is None:
+                self.statuses['error'] = self.statuses.get('error', 0) + 1
+                if len(self.errors) < 5:
+                    self.errors.append(error)
+                return
+            self.durations.append(duration)
+            status = response.status_code
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+            self.query_counts.append(len(queries))
+            for query in queries:
+                info = self.queries.setdefault(query.statement, [0, 0.0, 0.0])
+                info[0] += 1
+                info[1] += query.duration
+                info[2] = max(info[2], query.duration)
+            if self.profile:
+                if profiler is None:
+                    self.unprofiled += 1
+                elif self.stats is None:
+                    self.stats = pstats.Stats(profiler)
+                else:
+                    self.stats.add(profiler)
+
+    def summary(self, buckets=10):
+        """The latency distribution and queries of the batch, times in
+        milliseconds"""
+        durations = self.durations
+        count = len(durations)
+        histogram = []
+        if count:
+            low, high = durations[0], durations[-1]
+            width = (high - low) / buckets or 1.0
+            counts = [0] * buckets
+            for duration in durations:
+                counts[min(int((duration - low) / width), buckets - 1)] += 1
+            most = max(counts)
+            histogram = [{
+                'low': (low + width * i) * 1000,
+                'high': (low + width * (i + 1)) * 1000,
+                'count': n,
+                'percent': n * 100.0 / most,
+            } for i, n in enumerate(counts)]
+
+        queries = [{
+            'statement': statement,
+            'count': info[0],
+            'total': info[1] * 1000,
+            'mean': info[1] * 1000 / info[0],
+            'max': info[2] * 1000,
+        } for statement, info in iteritems(self.queries)]
+        queries.sort(key=lambda row: -row['total'])
+
+        return {
+            'count': count,
+            'elapsed': self.elapsed * 1000,
+            'throughput': count / self.elapsed if self.elapsed else 0.0,
+            'min': durations[0] * 1000 if count else 0.0,
+            'max': durations[-1] * 1000 if count else 0.0,
+            'mean': sum(durations) * 1000 / count if count else 0.0,
+            'p50': percentile(durations, 50) * 1000,
+            'p90': percentile(durations, 90) * 1000,
+            'p99': percentile(durations, 99) * 1000,
+            'histogram': histogram,
+            'statuses': sorted(iteritems(self.statuses), key=str),
+            'errors': self.errors,
+            'queries': queries,
+            'queries_per_request': (sum(self.query_counts) * 1.0 /
+                                    len(self.query_counts)
+                                    if self.query_counts else 0.0),
+            'query_time': sum(row['total'] for row in queries),
+            'unprofiled': self.unprofiled,
+        }
@@ -0,0 +1,98 @@
+"""Spans of a request, on a clock common to all the panels"""
+import functools
+import time
+
+from flask.globals import _request_ctx_stack
+
+from .compat import perf_counter
+
+
+class SpanRecorder(object):
+    """
+    Spans of a request as ``(category, name, start, end)`` tuples, start and
+    end being offsets in seconds from the start of the request. Points in
+    time (e.g. log records) have the same start and end.
+    """
+
+    def __init__(self, origin=None):
+        now = perf_counter()
+        self.origin = now if origin is None else origin
+        # the same instant on the time.time() clock
+        self.wall_origin = time.time() - (now - self.origin)
+        self.spans = []
+
+    def add(self, category, name, start, end=None):
+        """Add a span timed with ``perf_counter``"""
+        if end is None:
+            end = start
+        self.spans.append((category, name, start - self.origin,
+                           end - self.origin))
+
+    def add_wall(self, category, name, start, end=None):
+        """Add a span timed with ``time.time``"""
+        if end is None:
+            end = start
+        self.spans.append((category, name, start - self.wall_origin,
+                           end - self.wall_origin))
+
+    def add_any(self, category, name, start, end=None):
+        """
+        Add a span timed with either clock, e.g. by a library which picks
+        one depending on the platform: the timestamps of the request are
+        much closer to the origin of their own clock than of the other.
+        """
+        if abs(start - self.wall_origin) < abs(start - self.origin):
+            self.add_wall(category, name, start, end)
+        else:
+            self.add(category, name, start, end)
+
+
+def current_spans():
+    """Return the span recorder of the current request, None outside of an
+    instrumented request"""
+    toolbar = getattr(_request_ctx_stack.top, 'debug_toolbar', None)
+    return toolbar and toolbar.spans
+
+
+class span(object):
+    """
+    Mark a region of code as a span of the current request's timeline::
+
+        with span('load user'):
+            ...
+
+        @span('render feed', category='feed')
+        def render_feed():
+            ...
+
+    Outside of an instrumented request (e.g. the toolbar is disabled or the
+    request isn't shown one), this costs a lookup of the request context.
+    """
+
+    def __init__(self, name, category='app'):
+        self.name = name
+        self.category = category
+        self.recorder = None
+        self.start = None
+
+    def __enter__(self):
+        self.recorder = current_spans()
+        if self.recorder is not None:
+            self.start = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if self.recorder is not None:
+            self.recorder.add(self.category, self.name, self.start,
+                              perf_counter())
+            self.recorder = None
+
+    def __call__(self, func):
+        name, category = self.name, self.category
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            # a span per call, calls may nest or run concurrently
+            with span(name, category):
+                return func(*args, **kwargs)
+        return wrapper
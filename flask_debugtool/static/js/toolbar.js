@@ -1,11 +1,30 @@
 (function($) {
     $.cookie = function(name, value, options) { if (typeof value != 'undefined') { options = options || {}; if (value === null) { value = ''; options.expires = -1; } var expires = ''; if (options.expires && (typeof options.expires == 'number' || options.expires.toUTCString)) { var date; if (typeof options.expires == 'number') { date = new Date(); date.setTime(date.getTime() + (options.expires * 24 * 60 * 60 * 1000)); } else { date = options.expires; } expires = '; expires=' + date.toUTCString(); } var path = options.path ? '; path=' + (options.path) : ''; var domain = options.domain ? '; domain=' + (options.domain) : ''; var secure = options.secure ? '; secure' : ''; document.cookie = [name, '=', encodeURIComponent(value), expires, path, domain, secure].join(''); } else { var cookieValue = null; if (document.cookie && document.cookie != '') { var cookies = document.cookie.split(';'); for (var i = 0; i < cookies.length; i++) { var cookie = $.trim(cookies[i]); if (cookie.substring(0, name.length + 1) == (name + '=')) { cookieValue = decodeURIComponent(cookie.substring(name.length + 1)); break; } } } return cookieValue; } };
-    $('head').append('<link rel="stylesheet" href="'+DEBUG_TOOLBAR_STATIC_PATH+'css/toolbar.css?'+ Math.random() +'" type="text/css" />');
+    $('head').append('<link rel="stylesheet" href="'+DEBUG_TOOLBAR_STATIC_PATH+'css/toolbar.css" type="text/css" />');
     var COOKIE_NAME = 'fldt';
     var COOKIE_NAME_ACTIVE = COOKIE_NAME +'_active';
+    var INFO_PATH = '/_debug_toolbar/info/';
+    var REQUEST_ID_HEADER = 'X-Debug-Toolbar-Id';
     var fldt = {
+        // id of the request whose data is shown in the panels
+        request_id: null,
+        // requests made by the page (XHR/fetch) that carry toolbar data
+        requests: [],
+        initialized: false,
         init: function() {
             $('#flDebug').show();
+            fldt.request_id = $('#flDebug').attr('data-request-id');
+            fldt.requests.unshift({
+                id: fldt.request_id,
+                method: '',
+                url: window.location.pathname + window.location.search,
+                status: '',
+                type: 'page'
+            });
+            $.each(fldt.requests, function(i, req) {
+                fldt.add_request_row(req);
+            });
+            fldt.initialized = true;
             var current = null;
             $('#flDebugPanelList li a').click(function() {
                 if (!this.className) {
@@ -19,22 +38,25 @@
                 } else {
                     $('.panelContent').hide(); // Hide any that are already open
                     var name = $(this).attr("data-extra");
-                    $.ajax({
-                        url: "/_debug_toolbar/info/" + name,
-                        type: "GET",
-                        async: false,
-                        error: function (requet) {
-                            return ;
-                        },
-                        success: function (data) {
-                            if (data["info"]) {
-                                $(current).find(".title").html(data["info"]["title"]);
-                                $(ths).parent().find("small").html(data["info"]["nav_subtitile"]);
-                                $(current).find(".scroll").html(data["info"]["content"]);
+                    if (name) {
+                        $.ajax({
+                            url: INFO_PATH + fldt.request_id + "/" + name,
+                            type: "GET",
+                            async: false,
+                            error: function (requet) {
+                                return ;
+                            },
+                            success: function (data) {
+                                if (data["info"]) {
+                                    $(current).find(".title").html(data["info"]["title"]);
+                                    $(ths).parent().find("small").html(data["info"]["nav_subtitile"]);
+                                    $(current).find(".scroll").html(data["info"]["content"]);
+                                }
                             }
-                        }
-                    });
+                        });
+                    }
                     current.show();
+                    fldt.render_timeline(current);
                     $('#flDebugToolbar li').removeClass('active');
                     $(this).parent().addClass('active');
                 }
@@ -74,14 +96,24 @@
                 $('#flDebugToolbar li').removeClass('active');
                 return false;
             });
-            $('#flDebug a.remoteCall').click(function() {
-                $('#flDebugWindow').load(this.href, {}, function() {
+            var loadWindow = function(url, data) {
+                $('#flDebugWindow').load(url, data, function() {
                     $('#flDebugWindow a.flDebugBack').click(function() {
                         $(this).parent().parent().hide();
                         return false;
                     });
                 });
                 $('#flDebugWindow').show();
+            };
+            // also the links and forms of the panels loaded from the info of
+            // a request
+            $('#flDebug').delegate('a.remoteCall', 'click', function() {
+                loadWindow(this.href, {});
+                return false;
+            });
+            $('#flDebug').delegate('form.remoteCall', 'submit', function() {
+                // posted, the array of fields making load() use POST
+                loadWindow(this.action, $(this).serializeArray());
                 return false;
             });
             $('#flDebugTemplatePanel a.flTemplateShowContext').click(function() {
@@ -139,6 +171,117 @@
                     });
                 });
         },
+        capture_request: function(method, url, status, request_id, type) {
+            if (!request_id) {
+                return;
+            }
+            var req = {
+                id: request_id,
+                method: (method || 'GET').toUpperCase(),
+                url: url,
+                status: status,
+                type: type
+            };
+            fldt.requests.push(req);
+            if (fldt.initialized) {
+                fldt.add_request_row(req);
+            }
+        },
+        add_request_row: function(req) {
+            var $list = $('#flDebugRequestList');
+            var even = $list.children('tr').length % 2 == 1;
+            var $show = $('<a href="#">Show</a>').click(function() {
+                fldt.select_request(req.id);
+                return false;
+            });
+            $('<tr></tr>')
+                .attr('data-request-id', req.id)
+                .toggleClass('flDebugEven', even)
+                .toggleClass('flDebugOdd', !even)
+                .toggleClass('flDebugSelected', req.id == fldt.request_id)
+                .append($('<td></td>').text(req.method))
+                .append($('<td></td>').text(req.url))
+                .append($('<td></td>').text(req.status))
+                .append($('<td></td>').text(req.type))
+                .append($('<td></td>').append($show))
+                .appendTo($list);
+            $('#flDebugRequestsPanel small').text((fldt.requests.length - 1) + ' XHR');
+        },
+        select_request: function(request_id) {
+            $.ajax({
+                url: INFO_PATH + request_id,
+                type: "GET",
+                async: false,
+                success: function (data) {
+                    if (!data["request"]) {
+                        return;
+                    }
+                    fldt.request_id = request_id;
+                    $.each(data["panels"], function(name, info) {
+                        if (info) {
+                            $('#flDebugPanelList li a[data-extra="' + name + '"]')
+                                .parent().find("small").html(info["nav_subtitile"]);
+                        }
+                    });
+                    $('#flDebugRequestList tr').removeClass('flDebugSelected');
+                    $('#flDebugRequestList tr[data-request-id="' + request_id + '"]')
+                        .addClass('flDebugSelected');
+                }
+            });
+        },
+        render_timeline: function($panel) {
+            // Only the rows scrolled into view are in the DOM, a request
+            // can have thousands of them
+            var ROW_HEIGHT = 18;
+            $panel.find('.flDebugTimeline').each(function() {
+                var $timeline = $(this);
+                if ($timeline.data('rendered')) {
+                    return;
+                }
+                $timeline.data('rendered', true);
+                var rows = $.parseJSON($timeline.attr('data-rows'));
+                var total = parseFloat($timeline.attr('data-total')) || 1;
+                var $rows = $timeline.find('.flDebugTimelineRows');
+                var $spacer = $timeline.find('.flDebugTimelineSpacer');
+                $spacer.height(rows.length * ROW_HEIGHT);
+                var pending = false;
+                var draw = function() {
+                    pending = false;
+                    var first = Math.max(Math.floor($rows.scrollTop() / ROW_HEIGHT) - 10, 0);
+                    var last = Math.min(first + Math.ceil($rows.height() / ROW_HEIGHT) + 20,
+                                        rows.length);
+                    var html = [];
+                    for (var i = first; i < last; i++) {
+                        // category, name, count, start, end, duration
+                        var row = rows[i];
+                        var left = row[3] / total * 100;
+                        var width = Math.max((row[4] - row[3]) / total * 100, 0.2);
+                        html.push(
+                            '<div class="flDebugTimelineRow" style="top:' + (i * ROW_HEIGHT) + 'px">' +
+                            '<span class="flDebugTimelineLabel"></span>' +
+                            '<span class="flDebugTimelineCount">' + row[2] + '</span>' +
+                            '<span class="flDebugTimelineDuration">' + row[5].toFixed(2) + '</span>' +
+                            '<span class="flDebugTimelineTrack"><span class="flDebugTimelineBar flDebugTimeline-' +
+                            row[0].replace(/[^\w-]/g, '') + '" style="left:' + left + '%;width:' + width + '%"></span></span>' +
+                            '</div>');
+                    }
+                    $spacer.html(html.join(''));
+                    // names are set as text, they come from queries and logs
+                    $spacer.find('.flDebugTimelineLabel').each(function(j) {
+                        var row = rows[first + j];
+                        $(this).text(row[0] + ': ' + row[1])
+                            .attr('title', row[0] + ': ' + row[1] + ' @ ' + row[3].toFixed(2) + 'ms');
+                    });
+                };
+                $rows.scroll(function() {
+                    if (!pending) {
+                        pending = true;
+                        (window.requestAnimationFrame || setTimeout)(draw);
+                    }
+                });
+                draw();
+            });
+        },
         toggle_content: function(elem) {
             if (elem.is(':visible')) {
                 elem.hide();
@@ -201,6 +344,37 @@
         },
         $: $
     };
+    // Record the XHR/fetch requests made by the page, the ones which were
+    // instrumented tell us their toolbar id through a response header. When
+    // the toolbar was loaded by the deferred loader, the loader has already
+    // hooked them and queued what was requested so far.
+    if (window.fldtQueue) {
+        $.each(window.fldtQueue, function(i, args) {
+            fldt.capture_request.apply(fldt, args);
+        });
+    } else if (window.XMLHttpRequest) {
+        var xhr_open = window.XMLHttpRequest.prototype.open;
+        window.XMLHttpRequest.prototype.open = function(method, url) {
+            var xhr = this;
+            xhr.addEventListener('load', function() {
+                fldt.capture_request(method, url, xhr.status,
+                                     xhr.getResponseHeader(REQUEST_ID_HEADER), 'xhr');
+            });
+            return xhr_open.apply(this, arguments);
+        };
+    }
+    if (window.fetch && !window.fldtQueue) {
+        var fetch = window.fetch;
+        window.fetch = function(input, init) {
+            var method = (init && init.method) || input.method;
+            var url = input.url || String(input);
+            return fetch.apply(this, arguments).then(function(response) {
+                fldt.capture_request(method, url, response.status,
+                                     response.headers.get(REQUEST_ID_HEADER), 'fetch');
+                return response;
+            });
+        };
+    }
     $(document).ready(function() {
         fldt.init();
     });
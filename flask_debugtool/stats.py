@@ -0,0 +1,197 @@
+"""Aggregated request statistics, kept in process"""
+import itertools
+import math
+import threading
+import time
+
+from .compat import iteritems
+
+
+def percentile(values, percent):
+    """The nearest-rank percentile of sorted ``values``"""
+    if not values:
+        return 0.0
+    index = int(math.ceil(percent * len(values) / 100.0)) - 1
+    return values[min(max(index, 0), len(values) - 1)]
+
+
+def bucket_index(micros):
+    """
+    Index of the histogram bucket of a duration in microseconds: values
+    below ``Histogram.sub_buckets`` have a bucket each, every following
+    power of two is split in ``sub_buckets`` linear buckets.
+    """
+    sub_buckets = Histogram.sub_buckets
+    if micros < sub_buckets:
+        return max(micros, 0)
+    shift = micros.bit_length() - Histogram.sub_bucket_bits
+    return shift * sub_buckets + (micros >> shift)
+
+
+def bucket_bounds(index):
+    """Lowest and highest duration in microseconds of a bucket"""
+    sub_buckets = Histogram.sub_buckets
+    if index < sub_buckets:
+        return index, index
+    shift, sub = divmod(index, sub_buckets)
+    sub += sub_buckets
+    shift -= 1
+    return sub << shift, ((sub + 1) << shift) - 1
+
+
+class Histogram(object):
+    """
+    Log-linear histogram of durations. Each power of two is split in
+    ``sub_buckets`` buckets, so percentiles are accurate to ~6% while the
+    number of buckets stays bounded (a few hundred up to hours) whatever
+    the number of values added.
+    """
+    __slots__ = ('buckets', 'count', 'total', 'max')
+
+    sub_bucket_bits = 5
+    sub_buckets = 1 << (sub_bucket_bits - 1)
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, duration):
+        index = bucket_index(int(duration * 1e6))
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += duration
+        if duration > self.max:
+            self.max = duration
+
+    def merge(self, other):
+        for index, count in iteritems(other.buckets):
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def percentile(self, percent):
+        """Duration in seconds below which ``percent`` % of the values are"""
+        if not self.count:
+            return 0.0
+        rank = self.count * percent / 100.0
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                low, high = bucket_bounds(index)
+                return min((low + high) / 2.0 / 1e6, self.max)
+        return self.max
+
+
+class _Shard(object):
+    """Part of the statistics, updated by a subset of the threads"""
+
+    def __init__(self, slot_count):
+        self.lock = threading.Lock()
+        # (slot number, {key: Histogram}) per time slot, as a ring
+        self.slots = [(None, {})] * slot_count
+
+    def add(self, slot, key, duration):
+        position = slot % len(self.slots)
+        number, histograms = self.slots[position]
+        if number != slot:
+            histograms = {}
+            self.slots[position] = (slot, histograms)
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = Histogram()
+        histogram.add(duration)
+
+
+class RequestStats(object):
+    """
+    Request durations per endpoint, status class and timing, over sliding
+    windows. The ``app`` timing goes from ``before_request`` to
+    ``after_request``, the WSGI middleware adds ``wsgi`` (until the server
+    closed the response) and ``ttfb`` (until its first body byte).
+
+    The durations go in histograms per time slot of ``slot_seconds``, kept
+    for the longest window. Threads update one of a fixed number of shards,
+    each with its own lock held for a few dict operations, and reading
+    merges the slots of the window across the shards.
+    """
+    slot_seconds = 10
+    windows = (60, 300, 900)
+    shard_count = 8
+
+    def __init__(self):
+        slot_count = max(self.windows) // self.slot_seconds
+        self.shards = [_Shard(slot_count) for _ in range(self.shard_count)]
+        # Threads are given shards in turn: thread idents are aligned
+        # addresses, their low bits don't spread them over the shards
+        self.local = threading.local()
+        self.shard_numbers = itertools.count()
+
+    def _shard(self):
+        number = getattr(self.local, 'shard', None)
+        if number is None:
+            number = self.local.shard = \
+                next(self.shard_numbers) % self.shard_count
+        return self.shards[number]
+
+    def add(self, endpoint, status_code, duration, now=None, timing='app'):
+        if now is None:
+            now = time.time()
+        slot = int(now // self.slot_seconds)
+        key = (endpoint, '%dxx' % (status_code // 100), timing)
+        shard = self._shard()
+        with shard.lock:
+            shard.add(slot, key, duration)
+
+    def histograms(self, window, now=None):
+        """Return the merged histogram of each key over the last ``window``
+        seconds"""
+        if now is None:
+            now = time.time()
+        last = int(now // self.slot_seconds)
+        first = last - window // self.slot_seconds + 1
+        merged = {}
+        for shard in self.shards:
+            with shard.lock:
+                for number, histograms in shard.slots:
+                    if number is None or not first <= number <= last:
+                        continue
+                    for key, histogram in iteritems(histograms):
+                        if key not in merged:
+                            merged[key] = Histogram()
+                        merged[key].merge(histogram)
+        return merged
+
+    def summary(self, window, now=None):
+        """Rows of percentiles, throughput and error rate per endpoint,
+        status class and timing, durations in milliseconds"""
+        histograms = self.histograms(window, now)
+
+        totals = {}
+        errors = {}
+        for (endpoint, status, timing), histogram in iteritems(histograms):
+            key = (endpoint, timing)
+            totals[key] = totals.get(key, 0) + histogram.count
+            if status == '5xx':
+                errors[key] = errors.get(key, 0) + histogram.count
+
+        rows = []
+        for (endpoint, status, timing), histogram in sorted(histograms.items()):
+            key = (endpoint, timing)
+            rows.append({
+                'endpoint': endpoint,
+                'status': status,
+                'timing': timing,
+                'count': histogram.count,
+                'throughput': histogram.count / float(window),
+                'error_rate': errors.get(key, 0) / float(totals[key]),
+                'mean': histogram.total / histogram.count * 1000,
+                'p50': histogram.percentile(50) * 1000,
+                'p90': histogram.percentile(90) * 1000,
+                'p99': histogram.percentile(99) * 1000,
+                'max': histogram.max * 1000,
+            })
+        return rows
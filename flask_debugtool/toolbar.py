@@ -2,10 +2,31 @@ try:
     from urllib.parse import unquote
 except ImportError:
     from urllib import unquote
+import collections
+import traceback
+import uuid
 
 from flask import url_for, current_app
+from flask.globals import _request_ctx_stack
 from werkzeug.utils import import_string
 
+from .compat import get_ident, perf_counter
+from .debug_panel import DebugPanel
+from .middleware import WSGI_NAME
+from .spans import SpanRecorder
+from .utils import cache_key
+
+# Stack dumps kept per request by the hung request watchdog, the latest ones
+MAX_STACK_DUMPS = 20
+
+
+def current_toolbar():
+    """
+    Return the toolbar of the current request, None outside of a request
+    or when the request isn't instrumented
+    """
+    return getattr(_request_ctx_stack.top, 'debug_toolbar', None)
+
 
 class DebugToolbar(object):
 
@@ -14,11 +35,31 @@ class DebugToolbar(object):
     def __init__(self, request, jinja_env, cache=None):
         self.jinja_env = jinja_env
         self.request = request
+        self.request_id = uuid.uuid4().hex
         self.panels = []
         self.cache = cache
+        # If the panels processed the response, they don't for e.g. errors
+        self.processed = False
+        self.finalized = False
+        self.start = perf_counter()
+        self.spans = SpanRecorder(self.start)
+        # the thread serving the request, the panels may be finalized and
+        # its trace written on another one
+        self.thread_id = get_ident()
+        # when the view returned and the extension started processing the
+        # response
+        self.view_end = None
+        self.response_start = None
+        # Stacks of the request's thread, dumped while it ran for too long
+        self.stack_dumps = collections.deque(maxlen=MAX_STACK_DUMPS)
+        self.watch = None
+        # stored by store_summary, its nav added once finalized
+        self.summary = None
+        self.nav = None
 
         self.template_context = {
-            'static_path': url_for('_debug_toolbar.static', filename='')
+            'static_path': url_for('_debug_toolbar.static', filename=''),
+            'request_id': self.request_id,
         }
 
         self.create_panels()
@@ -32,12 +73,81 @@ class DebugToolbar(object):
 
         for panel_class in self._iter_panels(current_app):
             panel_instance = panel_class(jinja_env=self.jinja_env, context=self.template_context, cache=self.cache)
+            panel_instance.request_id = self.request_id
 
             if panel_instance.dom_id() in activated:
                 panel_instance.is_active = True
 
             self.panels.append(panel_instance)
 
+    def get_panel(self, panel_class):
+        """Return the panel of the given class, None if it isn't enabled"""
+        for panel in self.panels:
+            if isinstance(panel, panel_class):
+                return panel
+        return None
+
+    def dump_stack(self, frame):
+        """Record the current stack of the request, called by the watchdog"""
+        if frame is None:
+            return
+        self.stack_dumps.append({
+            'elapsed': perf_counter() - self.start,
+            'stack': ''.join(traceback.format_stack(frame)),
+        })
+
+    def process_response(self, response):
+        for panel in self.panels:
+            panel.process_response(self.request, response)
+        self.processed = True
+
+    def finalize(self):
+        """Run the heavy part of the panels' processing, once"""
+        if not self.processed or self.finalized:
+            return
+        self.finalized = True
+        for panel in self.panels:
+            panel.finalize()
+
+        # what the toolbar rendered later shows of the panels, gathered
+        # here rather than on the request thread
+        self.nav = [{
+            'name': panel.name,
+            'dom_id': panel.dom_id(),
+            'has_content': bool(panel.has_content),
+            'user_activate': getattr(panel, 'user_activate', False),
+            'is_active': panel.is_active,
+            'nav_title': panel.nav_title(),
+            'nav_subtitle': panel.nav_subtitle(),
+            'title': panel.title(),
+            'url': panel.url(),
+        } for panel in self.panels]
+        if self.cache and self.summary is not None:
+            self.summary['nav'] = self.nav
+            self.cache.set(cache_key(self.request_id), self.summary)
+
+    def store_summary(self, response):
+        """
+        Store what the data of this request can be found under, so it can
+        be looked up by id (e.g. for XHR requests, which never render the
+        toolbar themselves). Unless the panels were already finalized, e.g.
+        for the inline toolbar, their nav is added once they are.
+        """
+        if not self.cache:
+            return
+        self.summary = {
+            'id': self.request_id,
+            'method': self.request.method,
+            'url': self.request.full_path.rstrip('?'),
+            'is_xhr': self.request.is_xhr,
+            'status_code': response.status_code,
+            'content_type': response.mimetype,
+            'panels': [panel.name for panel in self.panels],
+            'stack_dumps': list(self.stack_dumps),
+            'nav': self.nav,
+        }
+        self.cache.set(cache_key(self.request_id), self.summary)
+
     def render_toolbar(self):
         context = self.template_context.copy()
         context.update({'panels': self.panels})
@@ -45,11 +155,61 @@ class DebugToolbar(object):
         template = self.jinja_env.get_template('base.html')
         return template.render(**context)
 
+    def render_loader(self):
+        """
+        Render the stub which fetches the toolbar of this request once the
+        page has loaded, instead of rendering the whole toolbar inline
+        """
+        context = self.template_context.copy()
+        context.update({
+            'toolbar_url': url_for('_debug_toolbar.toolbar',
+                                   request_id=self.request_id),
+        })
+
+        template = self.jinja_env.get_template('loader.html')
+        return template.render(**context)
+
     @classmethod
-    def load_panels(cls, app):
+    def render_stored(cls, jinja_env, cache, request_id):
+        """
+        Render the toolbar of an earlier request from the data it stored,
+        returns None if that data is no longer available
+        """
+        summary = cache.get(cache_key(request_id))
+        if summary is None or summary['nav'] is None:
+            return None
+
+        infos = cache.get_many(*[cache_key(request_id, nav['name'])
+                                 for nav in summary['nav']] +
+                               [cache_key(request_id, WSGI_NAME)])
+        summary['wsgi'] = infos.pop()
+        panels = [StoredPanel(nav, info, cls.stored_content(
+                      jinja_env, nav['name'], info or {}, summary))
+                  for nav, info in zip(summary['nav'], infos)]
+        context = {
+            'static_path': url_for('_debug_toolbar.static', filename=''),
+            'request_id': request_id,
+            'deferred': True,
+            'panels': panels,
+        }
+
+        template = jinja_env.get_template('base.html')
+        return template.render(**context)
+
+    @classmethod
+    def stored_content(cls, jinja_env, name, info, summary):
+        """The content of the panel ``name`` of an earlier request, from the
+        data it stored, see ``DebugPanel.stored_content``"""
+        panel_class = DebugPanel
+        for candidate in cls._iter_panels(current_app):
+            if candidate.name == name:
+                panel_class = candidate
+        return panel_class.stored_content(jinja_env, info, summary)
+
+    @classmethod
+    def load_panels(cls, app, jinja_env, cache=None):
         for panel_class in cls._iter_panels(app):
-            # just loop to make sure they've been loaded
-            pass
+            panel_class.init_app(app, jinja_env, cache)
 
     @classmethod
     def _iter_panels(cls, app):
@@ -75,3 +235,39 @@ class DebugToolbar(object):
 
         cache[path] = panel_class
         return panel_class
+
+
+class StoredPanel(object):
+    """
+    Stand-in for a panel of an earlier request, rendered from the data the
+    panel stored in the cache
+    """
+
+    def __init__(self, nav, info=None, content=None):
+        self.nav = nav
+        self.info = info or {}
+        self._content = content
+        self.name = nav['name']
+        self.has_content = nav['has_content']
+        self.user_activate = nav['user_activate']
+        self.is_active = nav['is_active']
+
+    def dom_id(self):
+        return self.nav['dom_id']
+
+    def nav_title(self):
+        return self.nav['nav_title']
+
+    def nav_subtitle(self):
+        return self.info.get('nav_subtitile', self.nav['nav_subtitle'])
+
+    def title(self):
+        return self.info.get('title', self.nav['title'])
+
+    def url(self):
+        return self.nav['url']
+
+    def content(self):
+        if self._content is not None:
+            return self._content
+        return self.info.get('content', '')
@@ -0,0 +1,168 @@
+"""Export of the spans of a request as trace files, for offline viewers"""
+import json
+import os
+import time
+import uuid
+
+
+def nest(spans):
+    """
+    Return the index of the parent of each span, the innermost span which
+    contains it (None for top level spans)
+    """
+    order = sorted(range(len(spans)),
+                   key=lambda i: (spans[i][2], -spans[i][3]))
+    parents = [None] * len(spans)
+    stack = []
+    for i in order:
+        start, end = spans[i][2], spans[i][3]
+        while stack and not (spans[stack[-1]][2] <= start and
+                             end <= spans[stack[-1]][3]):
+            stack.pop()
+        parents[i] = stack[-1] if stack else None
+        stack.append(i)
+    return parents
+
+
+def chrome_trace(recorder, request_info, duration, tid):
+    """The spans in the Chrome trace event format (chrome://tracing,
+    Perfetto, speedscope), on the lane of the thread ``tid`` which served
+    the request"""
+    pid = os.getpid()
+    origin = recorder.wall_origin * 1e6
+    events = [{
+        'name': '%(method)s %(url)s' % request_info,
+        'cat': 'request',
+        'ph': 'X',
+        'ts': origin,
+        'dur': duration * 1e6,
+        'pid': pid,
+        'tid': tid,
+        'args': request_info,
+    }]
+    for category, name, start, end in recorder.spans:
+        event = {
+            'name': name,
+            'cat': category,
+            'ts': origin + start * 1e6,
+            'pid': pid,
+            'tid': tid,
+        }
+        if end > start:
+            event.update(ph='X', dur=(end - start) * 1e6)
+        else:
+            event.update(ph='i', s='t')
+        events.append(event)
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+
+def _attributes(values):
+    attributes = []
+    for key, value in sorted(values.items()):
+        if isinstance(value, bool):
+            attributes.append({'key': key, 'value': {'boolValue': value}})
+        elif isinstance(value, int):
+            attributes.append({'key': key, 'value': {'intValue': str(value)}})
+        else:
+            attributes.append({'key': key,
+                               'value': {'stringValue': str(value)}})
+    return attributes
+
+
+def otlp_trace(recorder, request_info, duration, trace_id, service_name):
+    """The spans as an OTLP/JSON ``ExportTraceServiceRequest``, the request
+    being the root span and ``trace_id`` 32 hex digits"""
+    def nanos(offset):
+        return str(int((recorder.wall_origin + offset) * 1e9))
+
+    root_id = uuid.uuid4().hex[:16]
+    spans = recorder.spans
+    span_ids = [uuid.uuid4().hex[:16] for _ in spans]
+    otlp_spans = [{
+        'traceId': trace_id,
+        'spanId': root_id,
+        'name': '%(method)s %(url)s' % request_info,
+        'kind': 2,  # SPAN_KIND_SERVER
+        'startTimeUnixNano': nanos(0),
+        'endTimeUnixNano': nanos(duration),
+        'attributes': _attributes({
+            'http.method': request_info['method'],
+            'http.target': request_info['url'],
+            'http.status_code': request_info['status_code'],
+            'flask.endpoint': request_info['endpoint'],
+        }),
+    }]
+    for (category, name, start, end), span_id, parent in zip(
+            spans, span_ids, nest(spans)):
+        otlp_spans.append({
+            'traceId': trace_id,
+            'spanId': span_id,
+            'parentSpanId': root_id if parent is None else span_ids[parent],
+            'name': name,
+            'kind': 1,  # SPAN_KIND_INTERNAL
+            'startTimeUnixNano': nanos(start),
+            'endTimeUnixNano': nanos(end),
+            'attributes': _attributes({'category': category}),
+        })
+    return {'resourceSpans': [{
+        'resource': {'attributes': _attributes({'service.name': service_name})},
+        'scopeSpans': [{
+            'scope': {'name': 'flask_debugtool'},
+            'spans': otlp_spans,
+        }],
+    }]}
+
+
+class TraceWriter(object):
+    """
+    Writes the trace files of requests to a directory, one file per request
+    and format, removing the oldest files past ``max_files`` per format.
+    """
+    suffixes = {
+        'chrome': '.trace.json',
+        'otlp': '.otlp.json',
+    }
+
+    def __init__(self, directory, formats=('chrome', 'otlp'), max_files=100):
+        self.directory = directory
+        self.formats = formats
+        self.max_files = max_files
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def write(self, toolbar, response, service_name):
+        recorder = toolbar.spans
+        duration = max([end for _, _, _, end in recorder.spans] or [0.0])
+        rule = toolbar.request.url_rule
+        request_info = {
+            'method': toolbar.request.method,
+            'url': toolbar.request.full_path.rstrip('?'),
+            'status_code': response.status_code,
+            'endpoint': rule.endpoint if rule is not None else '',
+            'request_id': toolbar.request_id,
+        }
+        # named after the start of the request, so that they sort by age
+        prefix = '%s-%03d-%s' % (
+            time.strftime('%Y%m%d-%H%M%S', time.localtime(recorder.wall_origin)),
+            recorder.wall_origin % 1 * 1000, toolbar.request_id)
+        for trace_format in self.formats:
+            if trace_format == 'chrome':
+                trace = chrome_trace(recorder, request_info, duration,
+                                     toolbar.thread_id)
+            else:
+                trace = otlp_trace(recorder, request_info, duration,
+                                   toolbar.request_id, service_name)
+            suffix = self.suffixes[trace_format]
+            filename = os.path.join(self.directory, prefix + suffix)
+            with open(filename, 'w') as fp:
+                json.dump(trace, fp)
+            self.rotate(suffix)
+
+    def rotate(self, suffix):
+        names = sorted(name for name in os.listdir(self.directory)
+                       if name.endswith(suffix))
+        for name in names[:max(len(names) - self.max_files, 0)]:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass  # removed by another process
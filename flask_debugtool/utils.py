@@ -2,19 +2,12 @@ import itertools
 import os.path
 import sys
 
-try:
-    from pygments import highlight
-    from pygments.formatters import HtmlFormatter
-    from pygments.lexers import SqlLexer
-    from pygments.styles import get_style_by_name
-    PYGMENT_STYLE = get_style_by_name('colorful')
-    HAVE_PYGMENTS = True
-except ImportError:
-    HAVE_PYGMENTS = False
-
-
 from flask import current_app, Markup
 
+# Response header telling the client under which id the toolbar data of the
+# request can be fetched
+REQUEST_ID_HEADER = 'X-Debug-Toolbar-Id'
+
 
 def format_fname(value):
     # If the value has a builtin prefix, return it unchanged
@@ -54,6 +47,52 @@ def _relative_paths(value, paths, path_module):
             yield relval
 
 
+def get_call_site(skip_modules=()):
+    """
+    Return the ``(filename, lineno, function)`` of the innermost frame of
+    the caller which isn't part of the toolbar or of ``skip_modules`` (e.g.
+    the client library that was instrumented).
+    """
+    skip_modules = ('flask_debugtool',) + tuple(skip_modules)
+    frame = sys._getframe(1)
+    while frame is not None:
+        module = frame.f_globals.get('__name__') or ''
+        if not any(module == name or module.startswith(name + '.')
+                   for name in skip_modules):
+            code = frame.f_code
+            return code.co_filename, frame.f_lineno, code.co_name
+        frame = frame.f_back
+    return '<unknown>', 0, ''
+
+
+def get_debug_queries():
+    """
+    The queries Flask-SQLAlchemy recorded in the current application
+    context, None if the application doesn't use Flask-SQLAlchemy: the
+    toolbar never imports it itself, it is slow to import.
+    """
+    flask_sqlalchemy = sys.modules.get('flask_sqlalchemy')
+    if flask_sqlalchemy is None:
+        return None
+    # get_debug_queries was renamed in 3.0 and removed in 3.1
+    record_queries = sys.modules.get('flask_sqlalchemy.record_queries')
+    get_queries = (
+        getattr(flask_sqlalchemy, 'get_recorded_queries', None) or
+        getattr(record_queries, 'get_recorded_queries', None) or
+        getattr(flask_sqlalchemy, 'get_debug_queries', None))
+    if get_queries is None:
+        return None
+    return get_queries()
+
+
+def cache_key(request_id, name=None):
+    """Key under which the toolbar data of a request (or of one of its
+    panels, when ``name`` is given) is stored in the cache extension."""
+    if name is None:
+        return 'DEBUGTOOLBAR:%s' % request_id
+    return 'DEBUGTOOLBAR:%s:%s' % (request_id, name)
+
+
 def decode_text(value):
     """
         Decode a text-like value for display.
@@ -67,11 +106,32 @@ def decode_text(value):
         return value
 
 
+# Imported on the first query formatted, False without pygments
+_pygments = None
+
+
+def _import_pygments():
+    global _pygments
+    if _pygments is None:
+        try:
+            from pygments import highlight
+            from pygments.formatters import HtmlFormatter
+            from pygments.lexers import SqlLexer
+            from pygments.styles import get_style_by_name
+            _pygments = (highlight, HtmlFormatter, SqlLexer,
+                         get_style_by_name('colorful'))
+        except ImportError:
+            _pygments = False
+    return _pygments
+
+
 def format_sql(query, args):
-    if not HAVE_PYGMENTS:
+    pygments = _import_pygments()
+    if not pygments:
         return decode_text(query)
 
+    highlight, HtmlFormatter, SqlLexer, style = pygments
     return Markup(highlight(
         query,
         SqlLexer(),
-        HtmlFormatter(noclasses=True, style=PYGMENT_STYLE)))
+        HtmlFormatter(noclasses=True, style=style)))
@@ -0,0 +1,140 @@
+"""Thread looking at the stacks of the requests in flight"""
+import os
+import sys
+import threading
+
+from .compat import get_ident, perf_counter
+
+
+class Watch(object):
+    """
+    Calls ``callback`` with the current frame of the thread which created the
+    watch, ``delay`` seconds after its creation and then every ``interval``
+    seconds, until the watch is removed from the watchdog.
+    """
+
+    def __init__(self, callback, delay, interval):
+        self.ident = get_ident()
+        self.callback = callback
+        self.interval = interval
+        self.start = perf_counter()
+        self.due = self.start + delay
+
+
+class StackSampler(object):
+    """Counts of the functions found on the stack samples of a thread"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.samples = 0
+        # {(filename, first line, function name): count}, as pstats keys
+        self.self_counts = {}
+        self.cumulative_counts = {}
+
+    def add(self, frame):
+        if frame is None:
+            return
+        self.samples += 1
+        seen = set()
+        leaf = True
+        while frame is not None:
+            code = frame.f_code
+            key = (code.co_filename, code.co_firstlineno, code.co_name)
+            if leaf:
+                self.self_counts[key] = self.self_counts.get(key, 0) + 1
+                leaf = False
+            # recursive functions count once per sample
+            if key not in seen:
+                seen.add(key)
+                self.cumulative_counts[key] = \
+                    self.cumulative_counts.get(key, 0) + 1
+            frame = frame.f_back
+
+
+class Watchdog(object):
+    """
+    A single daemon thread serving all the watches of the process. It sleeps
+    until the next watch is due, so requests which finish before their delay
+    cost a dict insertion and removal.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.watches = set()
+        # the watches whose callbacks are being called, without the lock
+        self.running = set()
+        self.wake_at = None
+        self.thread = None
+        self.pid = None
+
+    def watch(self, watch):
+        with self.condition:
+            self._ensure_thread()
+            self.watches.add(watch)
+            if self.wake_at is None or watch.due < self.wake_at:
+                self.condition.notify()
+
+    def unwatch(self, watch):
+        # Its callback may be running, none runs after this returns
+        with self.condition:
+            self.watches.discard(watch)
+            while watch in self.running:
+                self.condition.wait()
+
+    def _ensure_thread(self):
+        # The thread doesn't survive a fork, e.g. into pre-forked workers
+        if self.pid == os.getpid() and self.thread.is_alive():
+            return
+        self.pid = os.getpid()
+        self.watches = set()
+        self.running = set()
+        self.wake_at = None
+        self.thread = threading.Thread(target=self._run,
+                                       name='flask_debugtool.watchdog')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _run(self):
+        with self.condition:
+            while True:
+                now = perf_counter()
+                due = [watch for watch in self.watches if watch.due <= now]
+                if due:
+                    for watch in due:
+                        watch.due += watch.interval
+                        if watch.due <= now:
+                            # fell behind, skip the missed calls
+                            watch.due = now + watch.interval
+                    self._call(due)
+                    continue
+
+                if self.watches:
+                    self.wake_at = min(watch.due for watch in self.watches)
+                    timeout = max(self.wake_at - perf_counter(), 0)
+                else:
+                    self.wake_at = timeout = None
+                self.condition.wait(timeout)
+
+    def _call(self, due):
+        # The callbacks, e.g. dumping a stack, run with the lock released, not
+        # to hold up the requests starting and finishing meanwhile
+        self.running = set(due)
+        frames = sys._current_frames()
+        self.condition.release()
+        try:
+            for watch in due:
+                if watch in self.watches:  # unless unwatched meanwhile
+                    watch.callback(frames.get(watch.ident))
+        finally:
+            del frames
+            self.condition.acquire()
+            self.running = set()
+            self.condition.notify_all()
+
+
+_watchdog = Watchdog()
+
+
+def get_watchdog():
+    """Return the watchdog of the process"""
+    return _watchdog
@@ -0,0 +1,110 @@
+import threading
+
+try:
+    import http.client as httplib
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    import httplib
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+from flask import Flask
+
+from flask_debugtool import DebugToolbarExtension
+from flask_debugtool.panels.outbound_http import OutboundHTTPDebugPanel
+from flask_debugtool.toolbar import current_toolbar
+
+try:
+    from werkzeug.contrib.cache import SimpleCache
+except ImportError:
+    from cachelib import SimpleCache
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        body = b'hello'
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = HTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def fetch(server, path):
+    conn = httplib.HTTPConnection('127.0.0.1', server.server_address[1])
+    try:
+        conn.request('GET', path)
+        response = conn.getresponse()
+        return response.status, response.read()
+    finally:
+        conn.close()
+
+
+@pytest.fixture
+def app(server):
+    app = Flask(__name__)
+    app.debug = True
+    app.config['SECRET_KEY'] = 'test'
+    app.config['DEBUG_TB_PANELS'] = (
+        'flask_debugtool.panels.outbound_http.OutboundHTTPDebugPanel',)
+    app.config['DEBUG_TB_FINALIZE_WORKERS'] = 0
+
+    @app.route('/')
+    def index():
+        status, body = fetch(server, '/remote?x=1')
+        return body
+
+    DebugToolbarExtension(app, SimpleCache())
+    return app
+
+
+def test_calls_of_the_request_are_recorded(app, server):
+    client = app.test_client()
+    with client:
+        response = client.get('/')
+        assert response.data == b'hello'
+        panel = current_toolbar().get_panel(OutboundHTTPDebugPanel)
+
+    assert len(panel.calls) == 1
+    call = panel.calls[0]
+    assert call['method'] == 'GET'
+    assert call['scheme'] == 'http'
+    assert call['host'] == '127.0.0.1'
+    assert call['port'] == server.server_address[1]
+    assert call['url'] == '/remote?x=1'
+    assert call['status'] == 200
+    assert call['new_connection']
+    assert call['bytes_received'] == len(b'hello')
+    assert call['bytes_sent'] > 0
+    assert call['end'] >= call['start']
+    for phase in ('dns', 'connect', 'tls', 'wait', 'transfer'):
+        assert call[phase] >= 0.0
+    assert call['wait'] > 0.0
+    assert call['tls'] == 0.0
+    assert call['end'] - call['start'] >= call['wait'] + call['transfer']
+
+
+def test_calls_outside_of_a_request_are_not_recorded(app, server):
+    client = app.test_client()
+    with client:
+        client.get('/')
+        panel = current_toolbar().get_panel(OutboundHTTPDebugPanel)
+
+    # the hooks are installed, but there is no toolbar to record into
+    assert fetch(server, '/outside') == (200, b'hello')
+    assert [call['url'] for call in panel.calls] == ['/remote?x=1']
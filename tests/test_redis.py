@@ -0,0 +1,91 @@
+import pytest
+from flask import Flask
+
+from flask_debugtool import DebugToolbarExtension
+from flask_debugtool.panels.redis import PIPELINE_THRESHOLD, RedisDebugPanel
+from flask_debugtool.toolbar import current_toolbar
+
+try:
+    from werkzeug.contrib.cache import SimpleCache
+except ImportError:
+    from cachelib import SimpleCache
+
+fakeredis = pytest.importorskip('fakeredis')
+
+COUNT = 5
+
+
+@pytest.fixture
+def redis_client():
+    return fakeredis.FakeStrictRedis()
+
+
+@pytest.fixture
+def app(redis_client):
+    app = Flask(__name__)
+    app.debug = True
+    app.config['SECRET_KEY'] = 'test'
+    app.config['DEBUG_TB_PANELS'] = (
+        'flask_debugtool.panels.redis.RedisDebugPanel',)
+    app.config['DEBUG_TB_FINALIZE_WORKERS'] = 0
+
+    @app.route('/loop')
+    def loop():
+        for i in range(COUNT):
+            redis_client.rpush('list:%d' % i, 'item')
+        return 'ok'
+
+    @app.route('/gets')
+    def gets():
+        for i in range(2):
+            redis_client.get('key:%d' % i)
+        return 'ok'
+
+    @app.route('/pipeline')
+    def pipeline():
+        pipe = redis_client.pipeline()
+        for i in range(COUNT):
+            pipe.rpush('list:%d' % i, 'item')
+        pipe.execute()
+        return 'ok'
+
+    DebugToolbarExtension(app, SimpleCache())
+    return app
+
+
+def request_panel(app, url):
+    client = app.test_client()
+    with client:
+        assert client.get(url).status_code == 200
+        return current_toolbar().get_panel(RedisDebugPanel)
+
+
+def test_commands_in_a_loop_are_flagged(app):
+    panel = request_panel(app, '/loop')
+    assert COUNT >= PIPELINE_THRESHOLD
+    assert [c['command'] for c in panel.commands] == ['RPUSH'] * COUNT
+    assert [c['key'] for c in panel.commands] == [
+        'list:%d' % i for i in range(COUNT)]
+    assert all(c['duration'] >= 0.0 for c in panel.commands)
+    assert [c['hint'] for c in panel.commands] == ['pipeline'] * COUNT
+    assert 'test_redis.py' in panel.commands[0]['context_long']
+
+
+def test_gets_of_several_keys_are_flagged(app):
+    panel = request_panel(app, '/gets')
+    assert [c['hint'] for c in panel.commands] == ['use MGET'] * 2
+
+
+def test_pipeline_is_recorded_once(app):
+    panel = request_panel(app, '/pipeline')
+    assert len(panel.commands) == 1
+    command = panel.commands[0]
+    assert command['command'] == 'PIPELINE'
+    assert command['pipelined'] == ['RPUSH'] * COUNT
+    assert command['hint'] is None
+
+
+def test_commands_outside_of_a_request_are_not_recorded(app, redis_client):
+    panel = request_panel(app, '/gets')
+    redis_client.set('outside', 1)
+    assert [c['command'] for c in panel.commands] == ['GET', 'GET']
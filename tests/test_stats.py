@@ -0,0 +1,71 @@
+import pytest
+
+from flask_debugtool.stats import Histogram, bucket_bounds, bucket_index, \
+    percentile
+
+
+def test_percentile_is_the_nearest_rank():
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 90) == 90
+    assert percentile(values, 99) == 99
+    assert percentile(values, 100) == 100
+    assert percentile(list(range(1, 11)), 50) == 5
+    assert percentile(list(range(1, 11)), 55) == 6
+    assert percentile(list(range(1, 11)), 7) == 1
+
+
+def test_percentile_bounds():
+    assert percentile([], 50) == 0.0
+    assert percentile([3], 0) == 3
+    assert percentile([3], 99) == 3
+    assert percentile([1, 2], 0) == 1
+
+
+def test_bucket_bounds_contain_their_values():
+    previous = -1
+    values = set(range(0, 5000)) | set(2 ** n + d for n in range(12, 40)
+                                       for d in (-1, 0, 1))
+    for micros in sorted(values):
+        index = bucket_index(micros)
+        assert index >= previous
+        previous = index
+        low, high = bucket_bounds(index)
+        assert low <= micros <= high
+        # buckets are at most 1/16th of their values wide
+        assert high - low <= max(low / Histogram.sub_buckets, 0)
+
+
+def test_buckets_are_contiguous():
+    for index in range(1, 500):
+        assert bucket_bounds(index)[0] == bucket_bounds(index - 1)[1] + 1
+
+
+def test_bucket_index_of_negative_durations():
+    assert bucket_index(-5) == 0
+
+
+def test_histogram_percentile():
+    histogram = Histogram()
+    assert histogram.percentile(50) == 0.0
+    for millis in range(1, 101):
+        histogram.add(millis / 1000.0)
+    assert histogram.count == 100
+    assert histogram.max == 0.1
+    assert histogram.total == pytest.approx(5.05)
+    for percent in (50, 90, 99):
+        assert histogram.percentile(percent) == pytest.approx(
+            percent / 1000.0, rel=0.07)
+    assert histogram.percentile(100) <= histogram.max
+
+
+def test_histogram_merge():
+    first, second = Histogram(), Histogram()
+    for millis in range(1, 51):
+        first.add(millis / 1000.0)
+    for millis in range(51, 101):
+        second.add(millis / 1000.0)
+    first.merge(second)
+    assert first.count == 100
+    assert first.max == 0.1
+    assert first.percentile(90) == pytest.approx(0.09, rel=0.07)